@@ -0,0 +1,174 @@
+"""
+Benchmark suite for the conversion pipeline.
+
+    python benchmarks/run.py --output bench.json
+    python benchmarks/run.py --compare bench.json   # fails if any median regressed past --threshold
+
+Times harvesting, transform, validation, JSON serialization and an end-to-end main() run
+against MockTranslationService and an in-memory MockDatabase, on synthetic
+forms (see synthetic.py). Results are written as JSON.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from database.mock import MockDatabase
+from services.mock import MockTranslationService
+from mappers.ampath import AmpathMapper
+from mappers.ir import parse_form
+import serialization
+from validation import validate_questionnaire
+from synthetic import generate_form
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "runs": repeat,
+        "min_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "mean_ms": round(statistics.mean(samples), 3),
+    }
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def make_config(workdir):
+    cwd = os.getcwd()
+    os.chdir(workdir) # Config() creates input/ and output/ under the cwd
+    try:
+        cfg = Config()
+    finally:
+        os.chdir(cwd)
+    cfg.translation_memory_path = None
+    return cfg
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(args):
+    form_params = dict(pages=args.pages, sections=args.sections, questions=args.questions,
+                       answers=args.answers, html_ratio=args.html_ratio,
+                       score_ratio=args.score_ratio, calc_ratio=args.calc_ratio)
+    source = generate_form(**form_params)
+    results = {}
+    quiet = contextlib.redirect_stdout(io.StringIO())
+
+    with tempfile.TemporaryDirectory() as workdir, quiet:
+        cfg = make_config(workdir)
+        mapper = AmpathMapper(cfg, MockDatabase(), MockTranslationService())
+
+        results["harvest"] = timed(lambda: list(mapper._harvest_strings(parse_form(source))), args.repeat)
+        results["transform"] = timed(lambda: mapper.transform(source), args.repeat)
+        results["transform"]["peak_bytes"] = peak_memory(lambda: mapper.transform(source))
+
+        questionnaire = mapper.transform(source)
+        results["serialize_indent"] = timed(lambda: json.dumps(questionnaire, indent=2), args.repeat)
+        results["serialize_indent"]["bytes"] = len(json.dumps(questionnaire, indent=2).encode("utf-8"))
+        # What convert.write_form produces, per backend
+        backends = ["stdlib", "orjson"] if serialization.orjson else ["stdlib"]
+        for backend in backends:
+            results[f"serialize_output_{backend}"] = timed(
+                lambda: serialization.dumps(questionnaire, 2, backend), args.repeat)
+            results[f"serialize_output_{backend}_compact"] = timed(
+                lambda: serialization.dumps(questionnaire, None, backend), args.repeat)
+        results["validate"] = timed(lambda: validate_questionnaire(questionnaire), args.repeat)
+        results["serialize_compact"] = timed(lambda: json.dumps(questionnaire, separators=(",", ":")), args.repeat)
+        results["serialize_compact"]["bytes"] = len(json.dumps(questionnaire, separators=(",", ":")).encode("utf-8"))
+
+        # End to end: main() over a directory of forms
+        for i in range(args.forms):
+            with open(os.path.join(cfg.input_dir, f"form_{i}.json"), "w", encoding="utf-8") as f:
+                json.dump(generate_form(seed=i, name=f"form{i}", **form_params), f)
+        import main as entrypoint
+        results["main"] = timed(
+            lambda: entrypoint.main([], config=cfg, db_service=MockDatabase(), trans_service=MockTranslationService()),
+            max(1, args.repeat // 5),
+        )
+        results["main"]["forms"] = args.forms
+        results["main_pipeline"] = timed(
+            lambda: entrypoint.main(["--pipeline"], config=cfg, db_service=MockDatabase(), trans_service=MockTranslationService()),
+            max(1, args.repeat // 5),
+        )
+        results["main_pipeline"]["forms"] = args.forms
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "json_backend": serialization.get_backend().name,
+        "params": {**form_params, "forms": args.forms, "repeat": args.repeat},
+        "results": results,
+    }
+
+def compare(report, baseline, threshold):
+    """Print median changes against a previous report. Returns names that regressed past threshold."""
+    regressions = []
+    for name, current in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        change = (current["median_ms"] - previous["median_ms"]) / previous["median_ms"]
+        print(f"{name:20} {previous['median_ms']:10.3f} -> {current['median_ms']:10.3f} ms  ({change:+.1%})", file=sys.stderr)
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the AMPATH -> FHIR conversion pipeline.")
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--sections", type=int, default=5)
+    parser.add_argument("--questions", type=int, default=50, help="Questions per section")
+    parser.add_argument("--answers", type=int, default=4, help="Answers per coded question")
+    parser.add_argument("--html-ratio", type=float, default=0.1)
+    parser.add_argument("--score-ratio", type=float, default=0.2)
+    parser.add_argument("--calc-ratio", type=float, default=0.05)
+    parser.add_argument("--forms", type=int, default=20, help="Forms in the end-to-end main() run")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE", help="Previous JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative median slowdown that counts as a regression (with --compare)")
+    args = parser.parse_args()
+
+    report = run_suite(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"Regressed: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Synthetic AMPATH form generator for benchmarks.
+Output is deterministic for a given seed so timings are comparable between commits.
+"""
+import argparse
+import json
+import random
+
+def generate_form(pages=4, sections=5, questions=50, answers=4, html_ratio=0.1,
+                  score_ratio=0.2, calc_ratio=0.05, seed=0, name="synthetic"):
+    """
+    pages x sections x questions items. Of the questions, html_ratio become
+    html display items; coded questions get 'answers' options, score_ratio of
+    them a score map, and calc_ratio of all questions a calculateExpression
+    over an earlier scored question.
+    """
+    rng = random.Random(seed)
+    # A small shared vocabulary, like real forms ("Yes", "No", ...) plus unique labels
+    common_answers = ["Yes", "No", "Unknown", "Not applicable", "Other", "Refused"]
+    scored = []
+    q_num = 0
+
+    def make_question():
+        nonlocal q_num
+        q_num += 1
+        q_id = f"q{q_num}"
+        roll = rng.random()
+        if roll < html_ratio:
+            return {
+                "id": f"html{q_num}",
+                "type": "markdown",
+                "questionOptions": {"rendering": "markdown",
+                                    "html": f"<p>Instructions for step <b>{q_num}</b>: read carefully.</p>"},
+            }
+        question = {
+            "id": q_id,
+            "label": f"Question {q_num}: how often does symptom {q_num % 97} occur?",
+            "type": "obs",
+            "required": rng.choice(["true", "false"]),
+            "questionOptions": {"concept": f"concept-{q_num:06d}"},
+        }
+        opts = question["questionOptions"]
+        if answers and rng.random() < 0.6:
+            opts["rendering"] = rng.choice(["radio", "select"])
+            opts["answers"] = []
+            for a in range(answers):
+                label = common_answers[a] if a < len(common_answers) else f"Option {a} of {q_id}"
+                opts["answers"].append({"concept": f"answer-{a:04d}", "label": label})
+            if rng.random() < score_ratio:
+                question["score"] = {ans["concept"]: i for i, ans in enumerate(opts["answers"])}
+                scored.append(q_id)
+        else:
+            opts["rendering"] = rng.choice(["text", "textarea", "number", "date"])
+        if scored and rng.random() < calc_ratio:
+            refs = rng.sample(scored, min(3, len(scored)))
+            opts["calculate"] = {"calculateExpression": " + ".join(f"(FORM.{r}.score[{r}] || 0)" for r in refs)}
+        return question
+
+    return {
+        "name": name,
+        "uuid": f"{name}-{seed}",
+        "encounter": f"encounter.{name}",
+        "display": f"{name.title()} Form",
+        "pages": [
+            {
+                "label": f"Page {p + 1}",
+                "sections": [
+                    {"label": f"Section {p + 1}.{s + 1}", "questions": [make_question() for _ in range(questions)]}
+                    for s in range(sections)
+                ],
+            }
+            for p in range(pages)
+        ],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic AMPATH form to stdout.")
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--sections", type=int, default=5)
+    parser.add_argument("--questions", type=int, default=50, help="Questions per section")
+    parser.add_argument("--answers", type=int, default=4, help="Answers per coded question")
+    parser.add_argument("--html-ratio", type=float, default=0.1)
+    parser.add_argument("--score-ratio", type=float, default=0.2)
+    parser.add_argument("--calc-ratio", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    form = generate_form(args.pages, args.sections, args.questions, args.answers,
+                         args.html_ratio, args.score_ratio, args.calc_ratio, args.seed)
+    print(json.dumps(form, indent=2))
+
+if __name__ == "__main__":
+    main()
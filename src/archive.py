@@ -0,0 +1,214 @@
+"""
+Streaming conversion of form archives: NDJSON (.ndjson/.jsonl, optionally
+.gz), tar (.tar, .tar.gz, .tgz, ...) and zip, on input and on output.
+Forms are read, transformed and written one at a time, so peak memory is
+bounded by the largest single form rather than by the archive.
+"""
+import calendar
+import contextlib
+import gzip
+import io
+import os
+import posixpath
+import tarfile
+import threading
+import time
+import zipfile
+
+import serialization
+from convert import output_name, write_form
+from incremental import source_date
+from metrics import metrics, profile_to
+from validation import check_output
+
+NDJSON_SUFFIXES = (".ndjson", ".jsonl", ".ndjson.gz", ".jsonl.gz")
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+# Stream compression tarfile applies itself; gzip goes through serialization.open_output() for a fixed header mtime
+TAR_STREAM_MODES = {".tar.bz2": "w|bz2", ".tar.xz": "w|xz"}
+
+def archive_kind(path):
+    """'ndjson', 'tar', 'zip' or None (a plain directory / file)."""
+    name = (path or "").lower()
+    if name.endswith(NDJSON_SUFFIXES):
+        return "ndjson"
+    if name.endswith(TAR_SUFFIXES):
+        return "tar"
+    if name.endswith(".zip"):
+        return "zip"
+    return None
+
+def iter_members(path):
+    """Yield (name, raw bytes, mtime) for every form in an archive or directory, one at a time."""
+    kind = archive_kind(path)
+    if kind == "ndjson":
+        stem = os.path.basename(path).split(".")[0]
+        mtime = int(os.path.getmtime(path))
+        with (gzip.open if path.endswith(".gz") else open)(path, "rb") as f:
+            for lineno, line in enumerate(f, 1):
+                if line.strip():
+                    yield f"{stem}-{lineno}.json", line, mtime
+    elif kind == "tar":
+        # Stream mode reads members sequentially, without seeking or building an index
+        with tarfile.open(path, "r|*") as tar:
+            for member in tar:
+                if member.isfile() and member.name.endswith(".json"):
+                    yield member.name, tar.extractfile(member).read(), int(member.mtime)
+    elif kind == "zip":
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and info.filename.endswith(".json"):
+                    # Zip timestamps carry no zone; read them as UTC so dates do not depend on the host
+                    yield info.filename, zf.read(info), calendar.timegm((*info.date_time, 0, 0, 0))
+    elif os.path.isdir(path):
+        for entry in sorted(os.scandir(path), key=lambda e: e.name):
+            if entry.is_file() and entry.name.endswith(".json"):
+                with open(entry.path, "rb") as f:
+                    yield entry.name, f.read(), int(entry.stat().st_mtime)
+    else:
+        raise ValueError(f"Not a directory or a supported archive: {path}")
+
+def iter_forms(path, backend="auto"):
+    """Parsed forms from iter_members(), skipping members that are not valid JSON."""
+    for name, raw, _ in iter_members(path):
+        try:
+            yield serialization.loads(raw, backend)
+        except ValueError as e:
+            print(f"   [Archive] Skipping {name}: {e}")
+
+def member_output_name(name):
+    """fhir_<name>, keeping the member's directory inside the archive."""
+    return posixpath.join(posixpath.dirname(name), output_name(name))
+
+class DirectoryWriter:
+    """
+    Writes fhir_<name> files. Archive members keep their directory under the
+    output directory, so a/x.json and b/x.json do not overwrite each other;
+    input files (absolute paths) are written by their file name.
+    """
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self._written = set()
+        self._lock = threading.Lock() # The pipeline writes from several threads
+
+    def write(self, name, resource, mtime):
+        if os.path.isabs(name):
+            out_name = output_name(name, self.cfg.output_gzip)
+        else:
+            relative = posixpath.normpath(name)
+            if relative.startswith("../") or posixpath.isabs(relative):
+                raise ValueError(f"Member path leaves the output directory: {name}")
+            out_name = member_output_name(relative) + (".gz" if self.cfg.output_gzip else "")
+        with self._lock:
+            if out_name in self._written:
+                raise ValueError(f"{out_name} was already written in this run (duplicate member {name})")
+            self._written.add(out_name)
+        out_path = os.path.join(self.cfg.output_dir, *out_name.split("/"))
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        write_form(resource, out_path, self.cfg.output_indent, self.cfg.output_gzip, self.cfg.json_backend)
+        return out_name
+
+    def close(self):
+        pass
+
+class NdjsonWriter:
+    """One compact Questionnaire per line."""
+
+    def __init__(self, cfg, path):
+        self.cfg = cfg
+        self.path = path
+        self.count = 0
+        self._stack = contextlib.ExitStack()
+        self._f = self._stack.enter_context(serialization.open_output(path, compress=path.endswith(".gz")))
+
+    def write(self, name, resource, mtime):
+        with metrics.stage("write") as st:
+            start = self._f.tell()
+            serialization.dump(resource, self._f, None, self.cfg.json_backend)
+            self._f.write(b"\n")
+            st.bytes = self._f.tell() - start
+        self.count += 1
+        return f"{os.path.basename(self.path)}:{self.count}"
+
+    def close(self):
+        self._stack.close()
+
+class TarWriter:
+    """Streams members into a tar (compressed per TAR_SUFFIXES) with fixed ownership and source mtimes."""
+
+    def __init__(self, cfg, path):
+        self.cfg = cfg
+        self._stack = contextlib.ExitStack()
+        lower = path.lower()
+        if not lower.endswith(TAR_SUFFIXES):
+            raise ValueError(f"Not a tar archive name ({', '.join(TAR_SUFFIXES)}): {path}")
+        mode = next((m for suffix, m in TAR_STREAM_MODES.items() if lower.endswith(suffix)), "w|")
+        compress = lower.endswith((".gz", ".tgz"))
+        f = self._stack.enter_context(serialization.open_output(path, compress))
+        self._tar = self._stack.enter_context(tarfile.open(fileobj=f, mode=mode, format=tarfile.PAX_FORMAT))
+
+    def write(self, name, resource, mtime):
+        out_name = member_output_name(name)
+        with metrics.stage("write") as st:
+            # A tar header needs the size up front, so one member's bytes are held at a time
+            data = serialization.dumps(resource, self.cfg.output_indent, self.cfg.json_backend)
+            info = tarfile.TarInfo(out_name)
+            info.size = len(data)
+            info.mtime = mtime
+            info.mode = 0o644
+            self._tar.addfile(info, io.BytesIO(data))
+            st.bytes = len(data)
+        return out_name
+
+    def close(self):
+        self._stack.close()
+
+class ZipWriter:
+    def __init__(self, cfg, path):
+        self.cfg = cfg
+        self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def write(self, name, resource, mtime):
+        out_name = member_output_name(name)
+        with metrics.stage("write") as st:
+            info = zipfile.ZipInfo(out_name, date_time=time.gmtime(max(mtime, 315532800))[:6]) # Zip dates start in 1980
+            info.compress_type = zipfile.ZIP_DEFLATED
+            # One write per member: deflate is far slower when fed many small chunks
+            data = serialization.dumps(resource, self.cfg.output_indent, self.cfg.json_backend)
+            self._zip.writestr(info, data)
+            st.bytes = info.compress_size
+        return out_name
+
+    def close(self):
+        self._zip.close()
+
+def create_writer(cfg):
+    """Writer for Config.output_archive, or the output directory when it is not set."""
+    path = getattr(cfg, "output_archive", None)
+    kind = archive_kind(path)
+    if kind == "ndjson":
+        return NdjsonWriter(cfg, path)
+    if kind == "tar":
+        return TarWriter(cfg, path)
+    if kind == "zip":
+        return ZipWriter(cfg, path)
+    return DirectoryWriter(cfg)
+
+def convert_archive(cfg, mapper, members, writer, profile_dir=None, sink=None):
+    """Transform (name, raw, mtime) members one by one into writer. Yields (name, out_name, error, untranslated)."""
+    for name, raw, mtime in members:
+        try:
+            with metrics.stage("read") as st:
+                st.bytes = len(raw)
+                data = serialization.loads(raw, cfg.json_backend)
+            del raw
+            profile_path = os.path.join(profile_dir, output_name(name) + ".prof") if profile_dir else None
+            with profile_to(profile_path):
+                fhir_result = mapper.transform(data, date=source_date(name, mtime))
+            check_output(fhir_result, cfg.validate_output, name)
+            out_name = writer.write(name, fhir_result, mtime)
+            if sink:
+                sink(fhir_result, name)
+            yield name, out_name, None, len(mapper.untranslated)
+        except Exception as e:
+            yield name, None, str(e), 0
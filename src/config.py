@@ -5,6 +5,10 @@ class Config:
         # Application Settings 
         self.locales = ["fr", "es", "ru", "ar"] # "en" is implicit source
         
+        # Backends (see database.BACKENDS / services.BACKENDS)
+        self.translation_backend = "gemini" # or "mock"
+        self.db_backend = None # "mysql", "snapshot" or "mock"; None = snapshot if snapshot_path is set, else mysql
+
         # Database Settings
         self.db_config = {
             "host": "localhost",
@@ -13,13 +17,66 @@ class Config:
             "password": "password",
             "database": "openmrs"
         }
+        self.db_pool_size = 0 # >0 enables pooled, thread-safe access with that many connections
+        self.db_ping_idle = 60.0 # Seconds a DB connection may sit idle before it is pinged on checkout
+        self.concept_cache_size = 50000 # Max concept names/form lookups kept in memory
+        # Offline metadata: path to a file written by --export-snapshot (None = query MySQL)
+        self.snapshot_path = None
         
         # Paths
         self.input_dir = os.path.join(os.getcwd(), "input")
         self.output_dir = os.path.join(os.getcwd(), "output")
+        # Component forms named in referencedForms (<formName>.json); None = references are not resolved
+        self.components_dir = None
+
+        # Archives (.ndjson/.jsonl, .tar/.tar.gz/.tgz, .zip) streamed instead of input_dir/output_dir
+        self.input_archive = None
+        self.output_archive = None
+
+        # Output format
+        self.json_backend = "auto" # "orjson" if installed, else "stdlib"
+        self.output_indent = 2 # None writes compact JSON
+        self.output_gzip = False # Write fhir_*.json.gz
+        # Structural check of every generated Questionnaire: "off", "warn" (print issues) or "error" (fail the form)
+        self.validate_output = "warn"
+
+        # Daemon mode (--watch)
+        self.watch_interval = 1.0 # Seconds between scans of input_dir
+        self.watch_debounce = 2.0 # A file must be unchanged this long before it is converted
+        self.watch_retry_interval = 60.0 # Forms converted with strings left untranslated are converted again after this
+
+        # Staged pipeline (--pipeline): threads per stage and forms buffered between stages
+        self.pipeline_workers = {"read": 2, "translate": 4, "map": 1, "write": 2} # transform() is CPU-bound, so one mapping thread is usually enough
+        self.pipeline_queue_size = 8
+
+        # HTTP conversion service (--serve)
+        self.serve_workers = 4 # Threads running transform(); the event loop only does I/O
+
+        # FHIR server upload (None = only write files)
+        self.fhir_base_url = None
+        self.fhir_bundle_type = "transaction" # All-or-nothing per Bundle; "batch" accepts entries individually
+        self.fhir_bundle_size = 50 # Questionnaires per Bundle
+        self.fhir_max_in_flight = 4 # Concurrent Bundle requests (and pooled connections)
+        self.fhir_retries = 3 # On connection errors, 429 and 5xx
+        self.fhir_headers = {} # e.g. {"Authorization": "Bearer ..."}
         
         # API Keys
         self.gemini_api_key = "YOUR_KEY"
+        self.gemini_requests_per_minute = 60
+        self.gemini_tokens_per_minute = 1000000
+        self.gemini_max_in_flight = 4 # Concurrent requests
+        self.gemini_chunk_tokens = 4000 # Estimated prompt + response tokens per request
+        self.gemini_max_chunk_strings = 50
+        self.gemini_retries = 3 # Per chunk, with exponential backoff; timed-out or garbled chunks are then split
+        self.gemini_retry_backoff = 1.0 # Seconds before the first retry
+        self.gemini_breaker_threshold = 5 # Consecutive failed requests before the rest are dropped...
+        self.gemini_breaker_cooldown = 60.0 # ...for this many seconds
+
+        # Translation Memory (set path to None to disable)
+        self.translation_memory_path = os.path.join(os.getcwd(), "cache", "translations.sqlite")
+        self.translation_memory_evict_after_days = None # Opt-in: after a run, drop entries of other model/prompt versions unused for this many days
+        # Use curated OpenMRS concept names as translations before calling the LLM
+        self.seed_translations_from_concepts = True
         
         # Domain Specifics
         self.ignored_questions = ["provider", "encDate"]
@@ -0,0 +1,66 @@
+"""Single-form conversion steps shared by the serial, batch and process-pool paths."""
+import gzip
+import os
+
+import serialization
+from metrics import metrics, profile_to
+from incremental import source_date
+from validation import check_output
+
+def output_name(file_path, compress=False):
+    return "fhir_" + os.path.basename(file_path) + (".gz" if compress else "")
+
+def load_form(file_path, backend="auto"):
+    with metrics.stage("read") as st:
+        with open(file_path, 'rb') as f:
+            raw = f.read()
+        st.bytes = len(raw)
+        return serialization.loads(raw, backend)
+
+def load_forms(files, backend="auto"):
+    """Yield (file_path, data) per file; data is None for files that do not load, and convert_form reports them."""
+    for file_path in files:
+        try:
+            yield file_path, load_form(file_path, backend)
+        except (OSError, ValueError):
+            yield file_path, None
+
+def write_form(fhir_result, out_path, indent=2, compress=False, backend="auto"):
+    with metrics.stage("write") as st:
+        with serialization.open_output(out_path, compress) as f_out:
+            serialization.dump(fhir_result, f_out, indent, backend)
+        st.bytes = os.path.getsize(out_path)
+
+def read_output(out_path, backend="auto"):
+    """Load a written Questionnaire back, e.g. to upload what worker processes wrote."""
+    with (gzip.open if out_path.endswith(".gz") else open)(out_path, 'rb') as f:
+        return serialization.loads(f.read(), backend)
+
+def convert_form(mapper, file_path, data, output_dir, profile_dir=None, sink=None):
+    """
+    Transform and write one form (loaded from file_path when data is None),
+    then pass the result and file_path to sink (e.g. an uploader's add) if
+    given. Returns (file_path, out_name, error, untranslated), untranslated
+    being the number of strings the backend returned nothing for.
+    """
+    cfg = mapper.config
+    out_name = output_name(file_path, cfg.output_gzip)
+    try:
+        if data is None:
+            data = load_form(file_path, cfg.json_backend)
+        profile_path = os.path.join(profile_dir, output_name(file_path) + ".prof") if profile_dir else None
+        with profile_to(profile_path):
+            fhir_result = mapper.transform(data, date=source_date(file_path))
+        check_output(fhir_result, cfg.validate_output, os.path.basename(file_path))
+        write_form(fhir_result, os.path.join(output_dir, out_name),
+                   cfg.output_indent, cfg.output_gzip, cfg.json_backend)
+        if sink:
+            sink(fhir_result, file_path)
+        return file_path, out_name, None, len(mapper.untranslated)
+    except Exception as e:
+        return file_path, None, str(e), 0
+
+def convert_serial(cfg, mapper, forms, profile_dir=None, sink=None):
+    """Transform and write (file_path, data) pairs in-process. Yields (file_path, out_name, error, untranslated)."""
+    for file_path, data in forms:
+        yield convert_form(mapper, file_path, data, cfg.output_dir, profile_dir, sink)
@@ -0,0 +1,26 @@
+# Backends are imported only when selected, so e.g. a mock run never loads mysql.connector
+def _mysql(config):
+    from .openmrs_sql import OpenMRSDatabase
+    return OpenMRSDatabase(config)
+
+def _snapshot(config):
+    from .snapshot import SnapshotDatabase
+    return SnapshotDatabase(config)
+
+def _mock(config):
+    from .mock import MockDatabase
+    return MockDatabase()
+
+BACKENDS = {"mysql": _mysql, "snapshot": _snapshot, "mock": _mock}
+
+def create_database(config, backend=None):
+    """
+    Build the DB backend named by 'backend' or Config.db_backend. When neither
+    is set: the offline snapshot if Config.snapshot_path is set, live OpenMRS MySQL otherwise.
+    """
+    backend = backend or getattr(config, "db_backend", None)
+    if not backend:
+        backend = "snapshot" if getattr(config, "snapshot_path", None) else "mysql"
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown database backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[backend](config)
@@ -1,5 +1,45 @@
+import re
 from abc import ABC, abstractmethod
 
+UNKNOWN_CONCEPT = "Unknown Concept"
+
+# Ranking when a concept has several names in one locale: preferred first,
+# then fully specified, synonyms, and abbreviations last
+NAME_TYPE_RANK = {"FULLY_SPECIFIED": 0, "": 1, "SHORT": 2, "INDEX_TERM": 3}
+
+def pick_concept_names(rows) -> dict:
+    """rows of (uuid, locale, name_type, preferred, name) -> {uuid: {locale: best name}}"""
+    best = {}
+    for concept_uuid, locale, name_type, preferred, name in rows:
+        rank = (0 if preferred else 1, NAME_TYPE_RANK.get(name_type or "", 1))
+        current = best.setdefault(concept_uuid, {}).get(locale)
+        if current is None or rank < current[0]:
+            best[concept_uuid][locale] = (rank, name)
+    return {u: {loc: name for loc, (_, name) in per_locale.items()} for u, per_locale in best.items()}
+
+def normalize_name(name: str) -> str:
+    """'encounter.adult_return' / 'Adult Return' -> 'adult return'"""
+    name = name.lower().replace("encounter.", "")
+    return " ".join(re.sub(r'[^a-z0-9]', ' ', name).split())
+
+def collect_concept_uuids(node, found=None) -> list:
+    """Every questionOptions.concept and answer concept UUID in an AMPATH form, in first-seen order."""
+    if found is None:
+        found = {}
+    if isinstance(node, dict):
+        opts = node.get("questionOptions")
+        if isinstance(opts, dict):
+            if opts.get("concept"): found[opts["concept"]] = None
+            for ans in opts.get("answers", []):
+                if ans.get("concept"): found[ans["concept"]] = None
+        for value in node.values():
+            if isinstance(value, (dict, list)):
+                collect_concept_uuids(value, found)
+    elif isinstance(node, list):
+        for item in node:
+            collect_concept_uuids(item, found)
+    return list(found)
+
 class DatabaseInterface(ABC):
     @abstractmethod
     def connect(self):
@@ -17,4 +57,16 @@ class DatabaseInterface(ABC):
     @abstractmethod
     def get_form_metadata(self, encounter_string: str):
         """Return tuple (form_uuid, encounter_type_uuid)."""
-        pass
\ No newline at end of file
+        pass
+
+    def get_concept_names(self, concept_uuids, locales) -> dict:
+        """Best name per locale for each concept: {uuid: {locale: name}}. Missing entries are omitted."""
+        return {}
+
+    def prefetch_concepts(self, concept_uuids) -> dict:
+        """Bulk-resolve concept names ahead of get_concept_name(). Returns {uuid: name or None}."""
+        return {}
+
+    def prefetch_form_concepts(self, form_json) -> dict:
+        """Bulk-resolve every concept referenced by an AMPATH form."""
+        return self.prefetch_concepts(collect_concept_uuids(form_json))
@@ -0,0 +1,37 @@
+from .base import DatabaseInterface, UNKNOWN_CONCEPT, normalize_name
+
+class MockDatabase(DatabaseInterface):
+    """In-memory stand-in for OpenMRS, for offline runs and benchmarks."""
+    name = "mock" # Key in database.BACKENDS
+
+    def __init__(self, concept_names=None, forms=None):
+        """
+        concept_names: {uuid: {locale: name}}
+        forms: {encounter_or_form_name: (form_uuid, encounter_type_uuid)}
+        """
+        self.concept_names = concept_names or {}
+        self.forms = {normalize_name(k): v for k, v in (forms or {}).items()}
+        self.lookups = 0
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+    def get_concept_name(self, concept_uuid: str) -> str:
+        self.lookups += 1
+        return self.concept_names.get(concept_uuid, {}).get("en", UNKNOWN_CONCEPT)
+
+    def get_concept_names(self, concept_uuids, locales) -> dict:
+        self.lookups += 1
+        result = {}
+        for concept_uuid in concept_uuids:
+            names = {loc: n for loc, n in self.concept_names.get(concept_uuid, {}).items() if loc in locales}
+            if names:
+                result[concept_uuid] = names
+        return result
+
+    def get_form_metadata(self, encounter_string: str):
+        self.lookups += 1
+        return self.forms.get(normalize_name(encounter_string), (None, None))
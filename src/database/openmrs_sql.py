@@ -1,35 +1,224 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
 import mysql.connector
-from .base import DatabaseInterface
+from metrics import metrics
+from .base import DatabaseInterface, UNKNOWN_CONCEPT, normalize_name, pick_concept_names
+from .cache import LRUCache
+
+# Max UUIDs bound into a single IN (...) clause
+CONCEPT_BATCH = 500
+# Rows pulled per round trip when streaming whole tables (snapshot export)
+FETCH_BATCH = 5000
 
 class OpenMRSDatabase(DatabaseInterface):
+    """
+    Single-connection mode (db_pool_size = 0) serializes lookups on one socket.
+    Pooled mode checks a connection out per lookup so threads can query concurrently.
+    Either way a connection is only pinged (and reconnected if it dropped) when
+    it sat idle for db_ping_idle seconds or its last lookup failed.
+    """
+    name = "mysql"
+
     def __init__(self, config):
         self.config = config
         self.conn = None
+        self._conn_used = None
+        self.pool = None # Idle (connection, last successful use) pairs in pooled mode
+        self.pool_size = getattr(config, "db_pool_size", 0)
+        self.ping_idle = getattr(config, "db_ping_idle", 60.0)
+        self._conn_lock = threading.Lock()
+        # At most pool_size connections are open; further lookups wait for one
+        self._pool_slots = threading.BoundedSemaphore(max(1, self.pool_size))
+        # uuid -> name (None when the concept has no English FSN), plus ("form", encounter) -> metadata
+        self.cache = LRUCache(getattr(config, "concept_cache_size", 50000))
+        self._forms_by_name = None
+        self._encounter_types_by_name = None
+
+    @property
+    def connected(self):
+        return self.conn is not None or self.pool is not None
 
     def connect(self):
+        """Open the connection (pooled mode: the first one); raises ConnectionError when MySQL is unreachable."""
         try:
-            self.conn = mysql.connector.connect(**self.config.db_config)
-        except Exception as e:
-            print(f"DB Connection failed: {e}")
+            conn = mysql.connector.connect(**self.config.db_config)
+        except mysql.connector.Error as e:
+            raise ConnectionError(f"DB connection failed: {e}") from e
+        if self.pool_size > 0:
+            self.pool = queue.LifoQueue()
+            self.pool.put((conn, time.monotonic()))
+        else:
+            self.conn, self._conn_used = conn, time.monotonic()
 
     def close(self):
+        if self.pool is not None:
+            # Called at shutdown; a connection still checked out is left to the driver
+            while True:
+                try:
+                    conn, _ = self.pool.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+            self.pool = None
         if self.conn and self.conn.is_connected():
             self.conn.close()
 
+    def _ready(self, conn, last_used):
+        """Ping (reconnecting if needed) a connection that sat idle too long or whose last lookup failed."""
+        if last_used is None or time.monotonic() - last_used > self.ping_idle:
+            metrics.incr("db.pings")
+            conn.ping(reconnect=True, attempts=3, delay=1)
+
+    @contextmanager
+    def _checkout(self):
+        """Yield a healthy connection for the duration of one lookup."""
+        pool = self.pool
+        if pool is not None:
+            with self._pool_slots:
+                try:
+                    conn, last_used = pool.get_nowait()
+                except queue.Empty:
+                    conn, last_used = mysql.connector.connect(**self.config.db_config), time.monotonic()
+                used = None # Stays None if the lookup fails, so the connection is pinged before its next one
+                try:
+                    self._ready(conn, last_used)
+                    yield conn
+                    used = time.monotonic()
+                finally:
+                    pool.put((conn, used))
+        else:
+            with self._conn_lock:
+                self._ready(self.conn, self._conn_used)
+                self._conn_used = None
+                yield self.conn
+                self._conn_used = time.monotonic()
+
     def get_concept_name(self, concept_uuid: str) -> str:
-        if not self.conn: return "Unknown Concept"
-        query = """
-            SELECT name FROM concept_name cn
-            JOIN concept c ON cn.concept_id = c.concept_id
-            WHERE c.uuid = %s AND cn.locale = 'en' AND cn.concept_name_type = 'FULLY_SPECIFIED'
-            LIMIT 1;
-        """
-        cursor = self.conn.cursor()
-        cursor.execute(query, (concept_uuid,))
-        res = cursor.fetchone()
-        cursor.close()
-        return res[0] if res else "Unknown Concept"
+        if not self.connected: return UNKNOWN_CONCEPT
+        if concept_uuid not in self.cache:
+            self.prefetch_concepts([concept_uuid])
+        return self.cache.get(concept_uuid) or UNKNOWN_CONCEPT
+
+    def get_concept_names(self, concept_uuids, locales) -> dict:
+        """Bulk-load concept_name rows for the given locales, CONCEPT_BATCH uuids per query."""
+        if not self.connected: return {}
+        locales = tuple(locales)
+        uuids = list(dict.fromkeys(concept_uuids))
+        missing = [u for u in uuids if u and ("names", u, locales) not in self.cache]
+        if missing:
+            with self._checkout() as conn:
+                cursor = conn.cursor()
+                try:
+                    for i in range(0, len(missing), CONCEPT_BATCH):
+                        batch = missing[i:i + CONCEPT_BATCH]
+                        cursor.execute(f"""
+                            SELECT c.uuid, cn.locale, COALESCE(cn.concept_name_type, ''), cn.locale_preferred, cn.name
+                            FROM concept_name cn
+                            JOIN concept c ON cn.concept_id = c.concept_id
+                            WHERE c.uuid IN ({", ".join(["%s"] * len(batch))})
+                            AND cn.locale IN ({", ".join(["%s"] * len(locales))}) AND cn.voided = 0;
+                        """, [*batch, *locales])
+                        metrics.incr("db.queries")
+                        names = pick_concept_names(cursor.fetchall())
+                        for concept_uuid in batch:
+                            self.cache.put(("names", concept_uuid, locales), names.get(concept_uuid, {}))
+                finally:
+                    cursor.close()
+
+        result = {}
+        for concept_uuid in uuids:
+            names = self.cache.get(("names", concept_uuid, locales))
+            if names:
+                result[concept_uuid] = names
+        return result
+
+    def prefetch_concepts(self, concept_uuids) -> dict:
+        """Resolve English fully specified names for all uuids not yet cached, CONCEPT_BATCH per query."""
+        if not self.connected: return {}
+        uuids = list(dict.fromkeys(concept_uuids)) # May be a generator; it is read twice
+        missing = [u for u in uuids if u and u not in self.cache]
+        if not missing:
+            return {u: self.cache.get(u) for u in uuids}
+
+        with self._checkout() as conn:
+            cursor = conn.cursor()
+            try:
+                for i in range(0, len(missing), CONCEPT_BATCH):
+                    batch = missing[i:i + CONCEPT_BATCH]
+                    query = f"""
+                        SELECT c.uuid, cn.name FROM concept_name cn
+                        JOIN concept c ON cn.concept_id = c.concept_id
+                        WHERE c.uuid IN ({", ".join(["%s"] * len(batch))})
+                        AND cn.locale = 'en' AND cn.concept_name_type = 'FULLY_SPECIFIED' AND cn.voided = 0;
+                    """
+                    cursor.execute(query, batch)
+                    metrics.incr("db.queries")
+                    names = dict(cursor.fetchall())
+                    # Cache misses too, so unknown uuids are not queried again
+                    for concept_uuid in batch:
+                        self.cache.put(concept_uuid, names.get(concept_uuid))
+            finally:
+                cursor.close()
+
+        return {u: self.cache.get(u) for u in uuids}
 
     def get_form_metadata(self, encounter_string: str):
-        if not self.conn: return None, None
-        return "mock-form-uuid", "mock-enc-uuid" # Placeholder for brevity
\ No newline at end of file
+        """
+        Match the AMPATH 'encounter' string against form names first, then
+        encounter type names. Returns (form_uuid, encounter_type_uuid); either may be None.
+        """
+        if not self.connected: return None, None
+        key = ("form", encounter_string)
+        if key not in self.cache:
+            if self._forms_by_name is None:
+                self._load_form_metadata()
+            name = normalize_name(encounter_string)
+            form_uuid, et_uuid = self._forms_by_name.get(name, (None, None))
+            if not et_uuid:
+                et_uuid = self._encounter_types_by_name.get(name)
+            self.cache.put(key, (form_uuid, et_uuid))
+        return self.cache.get(key)
+
+    def _load_form_metadata(self):
+        """Load the (small) form and encounter_type tables once."""
+        forms = {normalize_name(name): (f_uuid, et_uuid) for name, f_uuid, et_uuid in self.iter_forms()}
+        self._encounter_types_by_name = {normalize_name(name): et_uuid for name, et_uuid in self.iter_encounter_types()}
+        # Assigned last: other threads treat a non-None _forms_by_name as "loaded"
+        self._forms_by_name = forms
+
+    def iter_concept_names(self):
+        """Stream every non-voided concept name: (uuid, locale, name_type, preferred, name)."""
+        yield from self._stream("""
+            SELECT c.uuid, cn.locale, COALESCE(cn.concept_name_type, ''), cn.locale_preferred, cn.name
+            FROM concept_name cn
+            JOIN concept c ON cn.concept_id = c.concept_id
+            WHERE cn.voided = 0;
+        """)
+
+    def iter_forms(self):
+        """(name, form_uuid, encounter_type_uuid) for every non-retired form."""
+        yield from self._stream("""
+            SELECT f.name, f.uuid, et.uuid FROM form f
+            LEFT JOIN encounter_type et ON f.encounter_type = et.encounter_type_id
+            WHERE f.retired = 0;
+        """)
+
+    def iter_encounter_types(self):
+        """(name, encounter_type_uuid) for every non-retired encounter type."""
+        yield from self._stream("SELECT name, uuid FROM encounter_type WHERE retired = 0;")
+
+    def _stream(self, query):
+        with self._checkout() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query)
+                metrics.incr("db.queries")
+                while True:
+                    rows = cursor.fetchmany(FETCH_BATCH)
+                    if not rows:
+                        break
+                    yield from rows
+            finally:
+                cursor.close()
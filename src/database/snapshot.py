@@ -0,0 +1,171 @@
+import os
+import sqlite3
+import threading
+from metrics import metrics
+from .base import DatabaseInterface, UNKNOWN_CONCEPT, normalize_name, pick_concept_names
+from .cache import LRUCache
+
+# Max UUIDs bound into a single IN (...) clause (SQLite parameter limit)
+CONCEPT_BATCH = 500
+# Let SQLite read the file through mmap: pages live in the shared OS page cache,
+# so many worker processes can use one snapshot without each loading a copy.
+MMAP_SIZE = 1 << 30
+
+SCHEMA = """
+    CREATE TABLE concept_name (
+        uuid TEXT NOT NULL,
+        locale TEXT NOT NULL,
+        name_type TEXT NOT NULL,
+        preferred INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        PRIMARY KEY (uuid, locale, name_type, name)
+    ) WITHOUT ROWID;
+    CREATE TABLE form (
+        name_key TEXT PRIMARY KEY,
+        uuid TEXT NOT NULL,
+        encounter_type_uuid TEXT
+    ) WITHOUT ROWID;
+    CREATE TABLE encounter_type (
+        name_key TEXT PRIMARY KEY,
+        uuid TEXT NOT NULL
+    ) WITHOUT ROWID;
+"""
+
+def export_snapshot(source_db, path):
+    """
+    Dump concept names (all locales and name types), forms and encounter types
+    from a connected OpenMRSDatabase into an indexed SQLite file at 'path'.
+    Written to a temp file and renamed, so readers never see a partial snapshot.
+    """
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        conn.executemany(
+            "INSERT OR IGNORE INTO concept_name VALUES (?, ?, ?, ?, ?)",
+            ((u, loc, name_type, int(bool(pref)), name) for u, loc, name_type, pref, name in source_db.iter_concept_names()),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO form VALUES (?, ?, ?)",
+            ((normalize_name(name), f_uuid, et_uuid) for name, f_uuid, et_uuid in source_db.iter_forms()),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO encounter_type VALUES (?, ?)",
+            ((normalize_name(name), et_uuid) for name, et_uuid in source_db.iter_encounter_types()),
+        )
+        conn.commit()
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ("concept_name", "form", "encounter_type")}
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, path)
+    return counts
+
+class SnapshotDatabase(DatabaseInterface):
+    """Read-only DatabaseInterface over a file written by export_snapshot(). No live OpenMRS needed."""
+    name = "snapshot"
+
+    def __init__(self, config, path=None):
+        self.config = config
+        self.path = path or config.snapshot_path
+        self.cache = LRUCache(getattr(config, "concept_cache_size", 50000))
+        # One SQLite connection per thread; they all map the same file
+        self._local = threading.local()
+        self._conns = [] # Every thread's connection, so close() reaches them all
+        self._conns_lock = threading.Lock()
+        self.connected = False
+
+    def connect(self):
+        if not os.path.exists(self.path):
+            raise ConnectionError(f"Snapshot not found: {self.path}")
+        self.connected = True
+
+    def close(self):
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+            # Threads open a fresh connection if the snapshot is connected again
+            self._local = threading.local()
+        for conn in conns:
+            conn.close()
+        self.connected = False
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # immutable=1: no locking or change detection, the file is never written once exported
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            with self._conns_lock:
+                self._local.conn = conn
+                self._conns.append(conn)
+        return conn
+
+    def get_concept_name(self, concept_uuid: str) -> str:
+        if not self.connected: return UNKNOWN_CONCEPT
+        if concept_uuid not in self.cache:
+            self.prefetch_concepts([concept_uuid])
+        return self.cache.get(concept_uuid) or UNKNOWN_CONCEPT
+
+    def get_concept_names(self, concept_uuids, locales) -> dict:
+        if not self.connected: return {}
+        locales = tuple(locales)
+        uuids = list(dict.fromkeys(concept_uuids))
+        missing = [u for u in uuids if u and ("names", u, locales) not in self.cache]
+        conn = self._conn()
+        for i in range(0, len(missing), CONCEPT_BATCH):
+            batch = missing[i:i + CONCEPT_BATCH]
+            rows = conn.execute(f"""
+                SELECT uuid, locale, name_type, preferred, name FROM concept_name
+                WHERE uuid IN ({",".join("?" * len(batch))})
+                AND locale IN ({",".join("?" * len(locales))})
+            """, [*batch, *locales])
+            metrics.incr("db.queries")
+            names = pick_concept_names(rows.fetchall())
+            for concept_uuid in batch:
+                self.cache.put(("names", concept_uuid, locales), names.get(concept_uuid, {}))
+
+        result = {}
+        for concept_uuid in uuids:
+            names = self.cache.get(("names", concept_uuid, locales))
+            if names:
+                result[concept_uuid] = names
+        return result
+
+    def prefetch_concepts(self, concept_uuids) -> dict:
+        if not self.connected: return {}
+        uuids = list(dict.fromkeys(concept_uuids))
+        missing = [u for u in uuids if u and u not in self.cache]
+        conn = self._conn()
+        for i in range(0, len(missing), CONCEPT_BATCH):
+            batch = missing[i:i + CONCEPT_BATCH]
+            rows = conn.execute(f"""
+                SELECT uuid, name FROM concept_name
+                WHERE uuid IN ({",".join("?" * len(batch))})
+                AND locale = 'en' AND name_type = 'FULLY_SPECIFIED'
+            """, batch)
+            metrics.incr("db.queries")
+            names = dict(rows.fetchall())
+            for concept_uuid in batch:
+                self.cache.put(concept_uuid, names.get(concept_uuid))
+        return {u: self.cache.get(u) for u in uuids}
+
+    def get_form_metadata(self, encounter_string: str):
+        if not self.connected: return None, None
+        key = ("form", encounter_string)
+        if key not in self.cache:
+            name = normalize_name(encounter_string)
+            conn = self._conn()
+            row = conn.execute("SELECT uuid, encounter_type_uuid FROM form WHERE name_key = ?", (name,)).fetchone()
+            metrics.incr("db.queries")
+            form_uuid, et_uuid = row if row else (None, None)
+            if not et_uuid:
+                row = conn.execute("SELECT uuid FROM encounter_type WHERE name_key = ?", (name,)).fetchone()
+                et_uuid = row[0] if row else None
+            self.cache.put(key, (form_uuid, et_uuid))
+        return self.cache.get(key)
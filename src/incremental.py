@@ -0,0 +1,89 @@
+"""
+Content-addressed incremental conversion.
+A manifest in the output directory maps each input file to the fingerprint
+it was last converted with; forms whose fingerprint is unchanged are skipped.
+"""
+import datetime
+import hashlib
+import json
+import os
+
+from mappers.ampath import AmpathMapper
+from mappers.components import directory_digest
+
+MANIFEST_NAME = ".manifest.json"
+
+def config_fingerprint(config) -> str:
+    """Everything besides the input content that affects the generated output."""
+    settings = {
+        "locales": list(config.locales),
+        "ignored_questions": sorted(config.ignored_questions),
+        "mapper_version": AmpathMapper.VERSION,
+        "json_backend": config.json_backend,
+        "output_indent": config.output_indent,
+        "components": directory_digest(getattr(config, "components_dir", None)),
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+def file_fingerprint(file_path, config_digest) -> str:
+    digest = hashlib.sha256(config_digest.encode("utf-8"))
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_date(file_path, mtime=None):
+    """
+    Deterministic Questionnaire.date: SOURCE_DATE_EPOCH if set (reproducible
+    builds convention), otherwise the input's modification time ('mtime' for
+    archive members, else the file's).
+    """
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if epoch:
+        timestamp = int(epoch)
+    else:
+        timestamp = int(mtime if mtime is not None else os.path.getmtime(file_path))
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+
+class Manifest:
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable manifest {self.path}: {e}")
+
+    def is_fresh(self, name, fingerprint, out_path) -> bool:
+        return self.entries.get(name) == fingerprint and os.path.exists(out_path)
+
+    def record(self, name, fingerprint):
+        self.entries[name] = fingerprint
+
+    def save_converted(self, converted, fingerprints, uploader=None):
+        """
+        Record converted files and save. With an uploader, waits for the uploads
+        first and leaves out forms the server did not store, so the next run
+        converts and uploads them again. Returns those forms.
+        """
+        if uploader:
+            uploader.drain()
+        not_uploaded = []
+        for file_path in converted:
+            if uploader and file_path not in uploader.accepted:
+                not_uploaded.append(file_path)
+                continue
+            self.record(os.path.basename(file_path), fingerprints[file_path])
+        self.save()
+        if not_uploaded:
+            print(f"   [Incremental] {len(not_uploaded)} forms were not uploaded and will be converted again")
+        return not_uploaded
+
+    def save(self):
+        # Write-then-rename so an interrupted run never leaves a truncated manifest
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -1,45 +1,289 @@
-import json
+import argparse
 import os
 import glob
+import sys
 from config import Config
 
-from database.openmrs_sql import OpenMRSDatabase
-from services.gemini import GeminiTranslationService
-from services.mock import MockTranslationService
+# Backends (MySQL, Gemini...) and run modes (server, process pool) are imported
+# only when selected, so an offline/mock run does not pay for the SDKs.
+import database
+import services
+from services.memory import TranslationMemory, CachedTranslationService
 from mappers.ampath import AmpathMapper
+from convert import load_forms, convert_serial, output_name, read_output
+from metrics import metrics
+import serialization
+import validation
+from upload import create_uploader
+from watch import run_daemon
+from archive import archive_kind, iter_members, iter_forms, create_writer, convert_archive, DirectoryWriter
+from incremental import Manifest, config_fingerprint, file_fingerprint
 
-def main():
-    cfg = Config()
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert AMPATH OpenMRS forms to FHIR Questionnaires.")
+    parser.add_argument("--input", metavar="PATH",
+                        help="Directory of AMPATH form JSON files, or an .ndjson/.tar(.gz)/.zip archive (default: ./input)")
+    parser.add_argument("--output", metavar="PATH",
+                        help="Output directory, or an .ndjson/.tar(.gz)/.zip archive to stream into (default: ./output)")
+    parser.add_argument("--components", metavar="DIR",
+                        help="Directory of component forms that referencedForms/reference pages and sections resolve against")
+    parser.add_argument("--locales", metavar="LIST",
+                        help="Comma-separated target locales, e.g. fr,es (default: Config.locales)")
+    parser.add_argument("--translation", choices=services.BACKENDS,
+                        help="Translation backend (default: gemini; mock for local testing)")
+    parser.add_argument("--db", choices=database.BACKENDS,
+                        help="OpenMRS metadata backend (default: snapshot if --snapshot is set, else mysql)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Harvest all forms first and translate the whole corpus in one pass")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Map forms across N worker processes (implies --batch translation)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Read, translate, map and write on concurrent stages connected by bounded queues")
+    parser.add_argument("--stage-workers", metavar="LIST",
+                        help="Threads per pipeline stage, e.g. translate=8,write=4 (stages: read, translate, map, write)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Skip forms whose input and relevant config are unchanged since the last run")
+    parser.add_argument("--snapshot", metavar="PATH",
+                        help="Read OpenMRS metadata from an offline snapshot instead of MySQL")
+    parser.add_argument("--export-snapshot", metavar="PATH",
+                        help="Dump concept names, forms and encounter types from MySQL to PATH and exit")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="Write per-stage timings and counters as JSON to PATH")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="Dump a cProfile of each form's transform into DIR")
+    parser.add_argument("--compact", action="store_true",
+                        help="Write compact JSON instead of indenting it")
+    parser.add_argument("--gzip", action="store_true",
+                        help="Gzip the output files (fhir_*.json.gz)")
+    parser.add_argument("--json-backend", choices=serialization.BACKENDS,
+                        help="JSON encoder/decoder (default: orjson if installed, else stdlib)")
+    parser.add_argument("--validate", choices=validation.MODES,
+                        help="Check each Questionnaire's structure after mapping: print issues (warn, default) or fail the form (error)")
+    parser.add_argument("--upload", metavar="URL",
+                        help="Also upload the Questionnaires to this FHIR server base URL")
+    parser.add_argument("--bundle-type", choices=("transaction", "batch"),
+                        help="Bundle type for --upload (default: transaction)")
+    parser.add_argument("--bundle-size", type=int,
+                        help="Questionnaires per Bundle for --upload (default: 50)")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and convert forms in the input directory as they are added or changed")
+    parser.add_argument("--serve", metavar="[HOST:]PORT",
+                        help="Run the HTTP conversion service (POST /transform) instead of converting input/")
+    args = parser.parse_args(argv)
+    if args.watch and args.workers > 1:
+        parser.error("--watch converts in-process and cannot be combined with --workers")
+    if args.pipeline and (args.workers > 1 or args.watch):
+        parser.error("--pipeline cannot be combined with --workers or --watch")
+    if args.stage_workers:
+        try:
+            args.stage_workers = {
+                stage.strip(): int(count) for stage, _, count in (part.partition("=") for part in args.stage_workers.split(","))
+            }
+        except ValueError:
+            parser.error("--stage-workers expects stage=N pairs, e.g. translate=8,write=4")
+        unknown = set(args.stage_workers).difference(("read", "translate", "map", "write"))
+        if unknown:
+            parser.error(f"Unknown pipeline stage(s): {', '.join(sorted(unknown))}")
+    if (archive_kind(args.input) or archive_kind(args.output)) and (args.workers > 1 or args.incremental or args.watch):
+        parser.error("Archive input/output is streamed in-process; it cannot be combined with --workers, --incremental or --watch")
+    if args.serve is not None:
+        host, _, port = args.serve.rpartition(":")
+        if not port.isdigit() or int(port) > 65535:
+            parser.error(f"--serve expects [HOST:]PORT with a port from 0 to 65535, got '{args.serve}'")
+        args.serve = (host or "127.0.0.1", int(port))
+    return args
 
-    db_service = OpenMRSDatabase(cfg) 
-    
-    #trans_service = MockTranslationService()
-    trans_service = GeminiTranslationService(cfg.gemini_api_key)
+def convert_directory(args, cfg, mapper, uploader=None):
+    """One pass over every form in Config.input_dir."""
+    files = sorted(glob.glob(os.path.join(cfg.input_dir, "*.json")))
+    print(f"Found {len(files)} files.")
+
+    manifest = None
+    if args.incremental:
+        manifest = Manifest(cfg.output_dir)
+        config_digest = config_fingerprint(cfg)
+        fingerprints = {path: file_fingerprint(path, config_digest) for path in files}
+        files = [
+            path for path in files
+            if not manifest.is_fresh(os.path.basename(path), fingerprints[path],
+                                     os.path.join(cfg.output_dir, output_name(path, cfg.output_gzip)))
+        ]
+        print(f"Skipping {len(fingerprints) - len(files)} unchanged files.")
+
+    sink = uploader.add if uploader else None
+
+    if args.pipeline:
+        from pipeline import convert_pipelined
+        if args.batch:
+            mapper.prepare_translations(data for _, data in load_forms(files, cfg.json_backend) if data is not None)
+        results = convert_pipelined(cfg, mapper, ((path, None, None) for path in files),
+                                    DirectoryWriter(cfg), args.profile, sink)
+    elif args.workers > 1:
+        from workers import convert_parallel
+        # Translate once here; workers only map against the shared result and report unreadable files
+        mapper.prepare_translations(data for _, data in load_forms(files, cfg.json_backend) if data is not None)
+        # Workers open the same kind of database the parent uses, including an injected one
+        results = convert_parallel(cfg, mapper.shared_translations, files, args.workers, args.profile,
+                                   getattr(mapper.db, "name", None))
+    elif args.batch:
+        # Every form is held in memory so the corpus can be translated once
+        forms = list(load_forms(files, cfg.json_backend))
+        mapper.prepare_translations([data for _, data in forms if data is not None])
+        results = convert_serial(cfg, mapper, forms, args.profile, sink)
+    else:
+        forms = ((file_path, None) for file_path in files) # Loaded by convert_form
+        results = convert_serial(cfg, mapper, forms, args.profile, sink)
+
+    converted = []
+    for file_path, out_name, error, untranslated in results:
+        if error:
+            print(f"Failed {file_path}: {error}")
+            continue
+        if untranslated:
+            # Left out of the manifest, so the next incremental run converts it again
+            print(f"Mapped: {out_name} ({untranslated} strings untranslated)")
+        else:
+            print(f"Mapped: {out_name}")
+            converted.append(file_path)
+        if uploader and args.workers > 1:
+            # Workers only write files; upload what they wrote
+            uploader.add(read_output(os.path.join(cfg.output_dir, out_name), cfg.json_backend), file_path)
+
+    if manifest:
+        manifest.save_converted(converted, fingerprints, uploader)
+
+def stream_archive(args, cfg, mapper, uploader=None):
+    """Stream forms from an archive (or the input directory) into an archive (or the output directory)."""
+    source = cfg.input_archive or cfg.input_dir
+    print(f"Streaming forms from {source}")
+    if args.batch:
+        # Two passes over the source keep memory bounded: harvest/translate, then convert
+        mapper.prepare_translations(iter_forms(source, cfg.json_backend))
+    writer = create_writer(cfg)
+    sink = uploader.add if uploader else None
+    converted = failed = 0
+    try:
+        if args.pipeline:
+            from pipeline import convert_pipelined
+            results = convert_pipelined(cfg, mapper, iter_members(source), writer, args.profile, sink)
+        else:
+            results = convert_archive(cfg, mapper, iter_members(source), writer, args.profile, sink)
+        for name, out_name, error, untranslated in results:
+            if error:
+                failed += 1
+                print(f"Failed {name}: {error}")
+            else:
+                converted += 1
+                print(f"Mapped: {out_name}" + (f" ({untranslated} strings untranslated)" if untranslated else ""))
+    finally:
+        writer.close()
+    print(f"Streamed {converted} forms to {cfg.output_archive or cfg.output_dir} ({failed} failed)")
+
+def main(argv=None, config=None, db_service=None, trans_service=None):
+    """Services may be injected (tests, benchmarks); otherwise they are built from Config."""
+    args = parse_args(argv)
+    cfg = config or Config()
+    if args.input and archive_kind(args.input):
+        cfg.input_archive = os.path.abspath(args.input)
+    elif args.input:
+        cfg.input_dir = os.path.abspath(args.input)
+    if args.output and archive_kind(args.output):
+        cfg.output_archive = os.path.abspath(args.output)
+    elif args.output:
+        cfg.output_dir = os.path.abspath(args.output)
+        os.makedirs(cfg.output_dir, exist_ok=True)
+    if args.components:
+        cfg.components_dir = os.path.abspath(args.components)
+    if args.locales:
+        cfg.locales = [loc.strip() for loc in args.locales.split(",") if loc.strip()]
+    if args.translation:
+        cfg.translation_backend = args.translation
+    if args.db:
+        cfg.db_backend = args.db
+    if args.snapshot:
+        cfg.snapshot_path = args.snapshot
+    if args.compact:
+        cfg.output_indent = None
+    if args.gzip:
+        cfg.output_gzip = True
+    if args.json_backend:
+        cfg.json_backend = args.json_backend
+    if args.stage_workers:
+        cfg.pipeline_workers = {**cfg.pipeline_workers, **args.stage_workers}
+    if args.validate:
+        cfg.validate_output = args.validate
+    if args.upload:
+        cfg.fhir_base_url = args.upload
+    if args.bundle_type:
+        cfg.fhir_bundle_type = args.bundle_type
+    if args.bundle_size:
+        cfg.fhir_bundle_size = args.bundle_size
+
+    if args.export_snapshot:
+        from database.snapshot import export_snapshot
+        source_db = database.create_database(cfg, "mysql")
+        try:
+            source_db.connect()
+        except ConnectionError as e:
+            sys.exit(str(e))
+        counts = export_snapshot(source_db, args.export_snapshot)
+        source_db.close()
+        print(f"Snapshot written to {args.export_snapshot}: {counts}")
+        return
+
+    if db_service is None:
+        db_service = database.create_database(cfg)
+    if trans_service is None:
+        trans_service = services.create_translation_service(cfg)
+
+    memory = None
+    # Mock output is never cached, including an injected mock service
+    if (cfg.translation_memory_path and cfg.translation_backend != "mock"
+            and getattr(trans_service, "version", None) != "mock"):
+        memory = TranslationMemory(cfg.translation_memory_path)
+        trans_service = CachedTranslationService(trans_service, memory)
     
     # 3. Mapper
     mapper = AmpathMapper(cfg, db_service, trans_service)
 
-    db_service.connect()
+    try:
+        db_service.connect()
+    except ConnectionError as e:
+        # Converting without metadata would write placeholder concept names
+        if memory:
+            memory.close()
+        sys.exit(str(e))
     
-    files = glob.glob(os.path.join(cfg.input_dir, "*.json"))
-    print(f"Found {len(files)} files.")
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
 
-    for file_path in files:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        try:
-            fhir_result = mapper.transform(data)
-            
-            out_name = "fhir_" + os.path.basename(file_path)
-            with open(os.path.join(cfg.output_dir, out_name), 'w') as f_out:
-                json.dump(fhir_result, f_out, indent=2)
-            print(f"Mapped: {out_name}")
-            
-        except Exception as e:
-            print(f"Failed {file_path}: {e}")
+    uploader = create_uploader(cfg)
+    if args.serve:
+        from server import ConversionServer
+        ConversionServer(cfg, db_service, trans_service, cfg.serve_workers).run(*args.serve)
+    elif args.watch:
+        run_daemon(cfg, mapper, uploader, args.profile)
+    elif cfg.input_archive or cfg.output_archive:
+        stream_archive(args, cfg, mapper, uploader)
+    else:
+        convert_directory(args, cfg, mapper, uploader)
+
+    if uploader:
+        uploaded, failed = uploader.close()
+        print(f"Uploaded {uploaded} Questionnaires to {cfg.fhir_base_url} ({failed} failed)")
 
     db_service.close()
+    if memory:
+        print(f"Translation memory: {trans_service.hits} hits, {trans_service.misses} misses")
+        if cfg.translation_memory_evict_after_days is not None:
+            evicted = trans_service.evict_stale(cfg.translation_memory_evict_after_days)
+            print(f"Translation memory: evicted {evicted} entries of versions unused for "
+                  f"{cfg.translation_memory_evict_after_days} days")
+        memory.close()
+
+    print(f"Stage timings: {metrics.summary()}")
+    if args.metrics:
+        metrics.write_report(args.metrics)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,53 +1,192 @@
 import uuid
 import datetime
 import re
+from collections import ChainMap
 from .base import MapperInterface
+from metrics import metrics
+from serialization import SharedBlock
+from .ir import parse_form, iter_strings, iter_concept_labels, DISPLAY, OBS, SIMPLE
+from .components import ComponentLibrary
+
+# Namespace for name-based (uuid5) identifiers so repeated runs produce identical output
+ID_NAMESPACE = uuid.UUID("5b0e7c4e-3f8a-4d1b-9c61-2a7f0d9e4b13")
+
+# Stands in for the including form's linkId prefix while a component part is built
+LINK_SLOT = "\x00"
 
 class AmpathMapper(MapperInterface):
+    # Bump whenever the generated output changes so incremental runs rebuild every form
+    VERSION = "3"
+
     def __init__(self, config, db_service, translation_service):
         super().__init__(config, db_service, translation_service)
         self.variables = []
+        self.form_key = ""
+        self.generated_ids = 0
         self.translation_cache = {}
+        # text -> SharedBlock({"extension": [...]}), reused for every occurrence within a form
+        self.translation_blocks = {}
+        # Filled by prepare_translations() in batch mode, shared by every transform()
+        self.shared_translations = {}
+        self.prepared_strings = set()
+        # referencedForms resolution; parsed components and their built items live until refresh_components()
+        components_dir = getattr(config, "components_dir", None)
+        self.components = ComponentLibrary(components_dir, config.json_backend) if components_dir else None
+        self.link_prefix = ""
+        self.component_items = {} # component key -> (item with LINK_SLOT linkIds, its score variables)
+        # Set by transform(): strings the backend returned nothing for (shown untranslated in the output)
+        self.untranslated = []
+        self._built_components = []
+
+    def refresh_components(self) -> bool:
+        """Drop parsed and built components if a file in components_dir changed. Returns whether one did."""
+        if self.components is None or not self.components.refresh():
+            return False
+        self.component_items.clear()
+        return True
+
+    def prepare_translations(self, sources):
+        """
+        Batch mode: harvest every form up front and translate the deduplicated
+        corpus in a single pass. Subsequent transform() calls only translate
+        strings that were not part of that pass.
+        """
+        print("   [Mapper] Harvesting strings from all forms...")
+        unique_strings, concept_labels = self.harvest(sources)
+        if unique_strings:
+            print(f"   [Mapper] Translating {len(unique_strings)} unique strings for the corpus...")
+            self.translate_strings(unique_strings, concept_labels)
+        return len(unique_strings)
+
+    def harvest(self, sources):
+        """(strings not prepared yet, in first-seen order; label -> concept uuid) for the given forms."""
+        unique_strings = {}
+        concept_labels = {}
+        harvested = set(self.component_items)
+
+        def seen(group):
+            # Each shared component part is harvested once per pass, not once per including form
+            if group.component is None:
+                return False
+            if group.component in harvested:
+                return True
+            harvested.add(group.component)
+            return False
+
+        for source_json in sources:
+            with metrics.stage("harvest") as st:
+                try:
+                    form = parse_form(source_json, self.components)
+                except Exception as e:
+                    # transform() will report it for this form; keep the corpus pass going
+                    print(f"   [Mapper] Skipping unparseable form: {e}")
+                    continue
+                known = len(unique_strings)
+                for text in self._harvest_strings(form, seen):
+                    if text and text not in self.prepared_strings:
+                        unique_strings[text] = None
+                for label, concept_uuid in iter_concept_labels(form):
+                    concept_labels.setdefault(label, concept_uuid)
+                st.count = len(unique_strings) - known
+        return list(unique_strings), concept_labels
+
+    def harvest_form(self, source_json):
+        """
+        Parse one form and collect its strings not prepared yet, skipping
+        component parts already built. Returns (form, strings); transform()
+        accepts the pair so a caller that harvested first does not do it twice.
+        """
+        with metrics.stage("harvest") as st:
+            form = parse_form(source_json, self.components)
+            # Component parts built by an earlier form already carry their translations
+            built = lambda group: group.component in self.component_items
+            strings = list(dict.fromkeys(
+                s for s in self._harvest_strings(form, built) if s and s not in self.prepared_strings
+            ))
+            st.count = len(strings)
+        return form, strings
+
+    def translate_strings(self, strings, concept_labels):
+        """
+        Translate into shared_translations. Only strings that came back count
+        as prepared, so transform() asks for the others again.
+        """
+        with metrics.stage("translate") as st:
+            st.count = len(strings)
+            translated = self._translate(strings, concept_labels)
+            self.shared_translations.update(translated)
+        self.prepared_strings.update(text for text in strings if text in translated)
 
-    def transform(self, source_json):
+    def transform(self, source_json, date=None, harvested=None):
         """
         Main entry point for transformation.
-        1. Harvest all text.
-        2. Batch translate.
+        1. Harvest all text (or take harvest_form()'s result as 'harvested').
+        2. Batch translate (only strings not covered by prepare_translations).
         3. Map to FHIR using cache.
+        'date' (datetime) stamps Questionnaire.date; defaults to now.
         """
         self.variables = []
-        self.translation_cache = {}
+        self.generated_ids = 0
+        self.link_prefix = ""
+        self.translation_cache = self.shared_translations
+        self.translation_blocks = {}
+        self.untranslated = []
+        self._built_components = []
 
         # --- STEP 1: HARVEST STRINGS ---
-        print("   [Mapper] Harvesting strings for translation...")
-        all_strings = self._harvest_strings(source_json)
-        
+        if harvested is None:
+            print("   [Mapper] Harvesting strings for translation...")
+            harvested = self.harvest_form(source_json)
+        form, all_strings = harvested
+        self.form_key = form.key
+        # Strings translated since the harvest (e.g. by the pipeline's translation stage)
+        all_strings = [s for s in all_strings if s not in self.prepared_strings]
+
         # --- STEP 2: BATCH TRANSLATE ---
         if all_strings:
-            self.translation_cache = self.ts.batch_translate(all_strings, self.config.locales)
+            with metrics.stage("translate") as st:
+                st.count = len(all_strings)
+                concept_labels = {}
+                for label, concept_uuid in iter_concept_labels(form):
+                    concept_labels.setdefault(label, concept_uuid)
+                fresh = self._translate(all_strings, concept_labels)
+                self.translation_cache = ChainMap(fresh, self.shared_translations)
+            self.untranslated = [s for s in all_strings if s not in fresh and s.strip()]
+            if self.untranslated:
+                print(f"   [Mapper] {len(self.untranslated)} strings left untranslated")
+                metrics.incr("translate.untranslated", len(self.untranslated))
 
         # --- STEP 3: TRANSFORM (Standard Logic) ---
         print("   [Mapper] Generating FHIR resources...")
         
-        enc_string = source_json.get("encounter", "")
+        enc_string = form.encounter
         # Try DB lookup, fallback to generated UUIDs if DB not connected
-        try:
-            form_uuid, et_uuid = self.db.get_form_metadata(enc_string)
-        except:
-            form_uuid, et_uuid = str(uuid.uuid4()), str(uuid.uuid4())
-            
-        if not form_uuid: form_uuid = str(uuid.uuid4())
-        if not et_uuid: et_uuid = str(uuid.uuid4())
+        with metrics.stage("db"):
+            try:
+                form_uuid, et_uuid = self.db.get_form_metadata(enc_string)
+            except:
+                form_uuid, et_uuid = None, None
+
+        with metrics.stage("transform"):
+            questionnaire = self._build_questionnaire(form, enc_string, form_uuid, et_uuid, date)
+        if self.untranslated:
+            # Parts built without some translations are rebuilt (and re-harvested) by the next form
+            for key in self._built_components:
+                self.component_items.pop(key, None)
+        return questionnaire
+
+    def _build_questionnaire(self, form, enc_string, form_uuid, et_uuid, date):
+        if not form_uuid: form_uuid = self._stable_uuid("form", enc_string)
+        if not et_uuid: et_uuid = self._stable_uuid("encounter-type", enc_string)
 
-        display_name = source_json.get("display", enc_string.replace("encounter.", "").upper())
+        display_name = form.display_name
 
         questionnaire = {
             "resourceType": "Questionnaire",
-            "id": source_json.get("uuid", str(uuid.uuid4())),
+            "id": form.uuid or self._stable_uuid("questionnaire", self.form_key),
             "title": display_name,
             "status": "active",
-            "date": datetime.datetime.now().isoformat(),
+            "date": (date or datetime.datetime.now()).isoformat(),
             "subjectType": ["Encounter", "Patient", "Practitioner"],
             "code": [
                 {
@@ -68,10 +207,8 @@ class AmpathMapper(MapperInterface):
         self._inject_translation(questionnaire, display_name, is_root=True)
 
         # Process Pages
-        if "pages" in source_json:
-            for page in source_json["pages"]:
-                q_item = self._process_group(page, is_page=True)
-                questionnaire["item"].append(q_item)
+        for page in form.pages:
+            questionnaire["item"].append(self._process_group(page))
 
         # Inject Variables (Scoring) at Root
         if self.variables:
@@ -88,42 +225,51 @@ class AmpathMapper(MapperInterface):
         
         return questionnaire
 
-    def _harvest_strings(self, node) -> list:
-        """Recursive function to find all translatable text in the raw JSON."""
-        strings = []
-        
-        if isinstance(node, dict):
-            # Check common label keys
-            if "label" in node: strings.append(node["label"])
-            # 'text' key is rare in Ampath source but check anyway
-            if "text" in node: strings.append(node["text"])
-            
-            # Check HTML/Display
-            if "questionOptions" in node:
-                opts = node["questionOptions"]
-                if "html" in opts: 
-                    clean = re.sub('<[^<]+?>', '', opts["html"])
-                    strings.append(clean)
-                if "answers" in opts:
-                    for ans in opts["answers"]:
-                        if "label" in ans: strings.append(ans["label"])
-
-            # Recurse
-            for key, value in node.items():
-                strings.extend(self._harvest_strings(value))
-                
-        elif isinstance(node, list):
-            for item in node:
-                strings.extend(self._harvest_strings(item))
-                
-        return strings
-
-    def _process_group(self, group_json, is_page=False):
+    def _translate(self, strings, concept_labels):
+        """
+        Translate strings, seeding from curated OpenMRS concept names first.
+        A string is seeded only when it is the label of a concept whose English
+        name matches it; only locales the dictionary lacks go to the backend.
+        """
+        locales = self.config.locales
+        seeded = {}
+        if getattr(self.config, "seed_translations_from_concepts", False) and concept_labels:
+            wanted = {text: concept_labels[text] for text in strings if text in concept_labels}
+            with metrics.stage("db"):
+                names = self.db.get_concept_names(list(set(wanted.values())), ["en", *locales]) if wanted else {}
+            for text, concept_uuid in wanted.items():
+                per_locale = names.get(concept_uuid, {})
+                if per_locale.get("en", "").strip().casefold() != text.strip().casefold():
+                    continue
+                vetted = {loc: per_locale[loc] for loc in locales if loc in per_locale}
+                if vetted:
+                    seeded[text] = vetted
+
+        remaining = [t for t in strings if len(seeded.get(t, ())) < len(locales)]
+        if seeded:
+            print(f"   [Mapper] Seeded {len(seeded)} strings from concept names, {len(remaining)} left for translation")
+        metrics.incr("translate.seeded", len(seeded))
+        metrics.incr("translate.backend_strings", len(remaining))
+
+        result = self.ts.batch_translate(remaining, locales) if remaining else {}
+        for text, vetted in seeded.items():
+            merged = {**result.get(text, {}), **vetted}
+            result[text] = {loc: merged[loc] for loc in locales if loc in merged}
+        return result
+
+    def _harvest_strings(self, form, skip=None):
+        """Generator over every translatable string of a parsed form (see ir.iter_strings)."""
+        return iter_strings(form, self.config.ignored_questions, skip)
+
+    def _process_group(self, group):
         """Handles Pages and Sections recursively."""
-        label = group_json.get("label", "Group")
+        if group.component is not None:
+            return self._component_group(group)
+
+        label = group.label
         # Sanitize label for linkId
         safe_label = re.sub(r'[^a-zA-Z0-9]', '-', label.lower())
-        link_id = f"page-{safe_label}" if is_page else f"section-{safe_label}"
+        link_id = f"{self.link_prefix}page-{safe_label}" if group.is_page else f"{self.link_prefix}section-{safe_label}"
         
         item = {
             "linkId": link_id,
@@ -133,7 +279,7 @@ class AmpathMapper(MapperInterface):
         }
 
         # Page Extension
-        if is_page:
+        if group.is_page:
             item["extension"] = [{
                 "url": "http://hl7.org/fhir/StructureDefinition/questionnaire-itemControl",
                 "valueCodeableConcept": {
@@ -144,45 +290,71 @@ class AmpathMapper(MapperInterface):
         self._inject_translation(item, label)
 
         # Process Sub-sections
-        if "sections" in group_json:
-            for section in group_json["sections"]:
-                item["item"].append(self._process_group(section, is_page=False))
+        for section in group.sections:
+            item["item"].append(self._process_group(section))
         
         # Process Questions
-        if "questions" in group_json:
-            for question in group_json["questions"]:
-                
-                # 1. Handle Display/HTML Instructions
-                if self._is_display_element(question):
-                    item["item"].append(self._create_display_item(question))
-                    continue
-
-                # 2. Skip Ignored
-                if question.get("id") in self.config.ignored_questions:
-                    continue
-
-                # 3. Handle SDC Extraction Pattern (Obs)
-                # Matches if type is 'obs' OR has a concept mapped
-                opts = question.get("questionOptions", {})
-                if question.get("type") == "obs" or "concept" in opts:
-                    item["item"].append(self._create_extraction_group(question))
-                
-                # 4. Handle Simple Inputs (e.g. Encounter Date)
-                elif question.get("type") in ["encounterDatetime", "encounterProvider"]:
-                    # Simplify for now, treat as date/string
-                    fhir_type = "date" if "Date" in question.get("type") else "string"
-                    item["item"].append(self._create_simple_input(question, fhir_type))
+        ignored = self.config.ignored_questions
+        for question in group.questions:
+            
+            # 1. Handle Display/HTML Instructions
+            if question.kind == DISPLAY:
+                item["item"].append(self._create_display_item(question))
+                continue
+
+            # 2. Skip Ignored
+            if question.id in ignored:
+                continue
+
+            # 3. Handle SDC Extraction Pattern (Obs)
+            # Matches if type is 'obs' OR has a concept mapped
+            if question.kind == OBS:
+                item["item"].append(self._create_extraction_group(question))
+            
+            # 4. Handle Simple Inputs (e.g. Encounter Date)
+            elif question.kind == SIMPLE:
+                # Simplify for now, treat as date/string
+                fhir_type = "date" if "Date" in question.type else "string"
+                item["item"].append(self._create_simple_input(question, fhir_type))
 
         return item
 
-    def _create_extraction_group(self, q_json):
+    def _component_group(self, group):
+        """
+        A referenced component page/section. It is built once per run with
+        LINK_SLOT in place of the prefix, then copied with the prefix filled in
+        for every form (or enclosing component) that includes it.
+        """
+        cached = self.component_items.get(group.component)
+        if cached is None:
+            metrics.incr("components.built")
+            saved = (self.form_key, self.generated_ids, self.variables, self.link_prefix)
+            # Generated linkIds depend on the component part, not on the first form that used it
+            self.form_key = "/".join(str(part) for part in group.component)
+            self.generated_ids = 0
+            self.variables = []
+            self.link_prefix = LINK_SLOT
+            try:
+                item = self._process_group(_Unshared(group))
+                cached = self.component_items[group.component] = (item, self.variables)
+                self._built_components.append(group.component)
+            finally:
+                self.form_key, self.generated_ids, self.variables, self.link_prefix = saved
+        else:
+            metrics.incr("components.reused")
+
+        item, variables = cached
+        prefix = self.link_prefix + group.prefix
+        self.variables.extend(_relink(var, prefix) for var in variables)
+        return _relink(item, prefix)
+
+    def _create_extraction_group(self, q):
         """
         Creates the 3-level structure for SDC Extraction:
         Group (Context=Obs) -> [Inner Group -> [Input Item, Hidden Code Item]]
         """
-        q_id = q_json.get("id", str(uuid.uuid4()))
-        opts = q_json.get("questionOptions", {})
-        concept_uuid = opts.get("concept", "UNKNOWN-CONCEPT")
+        q_id = self.link_prefix + (q.id or self._next_id())
+        concept_uuid = q.concept
         
         # A. The Wrapper Group (Extraction Context)
         wrapper = {
@@ -207,48 +379,46 @@ class AmpathMapper(MapperInterface):
         }
         
         # Definition is often required on the inner group for validation in some parsers
-        if self._determine_fhir_type(q_json) == "choice":
+        if q.fhir_type == "choice":
              inner_group["definition"] = "http://hl7.org/fhir/StructureDefinition/Observation#Observation.valueCodeableConcept"
 
         # C. The Visible Input Item
-        input_type = self._determine_fhir_type(q_json)
         input_item = {
             "linkId": q_id,
-            "type": input_type,
-            "text": q_json.get("label", "Question"),
-            "required": q_json.get("required") == "true"
+            "type": q.fhir_type,
+            "text": q.label if q.label is not None else "Question",
+            "required": q.required
         }
         
-        if "prefix" in q_json:
-            input_item["prefix"] = q_json["prefix"]
+        if q.has_prefix:
+            input_item["prefix"] = q.prefix
 
         self._inject_translation(input_item, input_item["text"])
-        self._add_item_control(input_item, q_json)
+        self._add_item_control(input_item, q)
 
         # Handle Answers (Choices)
-        if "answers" in opts:
+        if q.answers is not None:
             input_item["answerOption"] = []
-            for ans in opts["answers"]:
+            for ans in q.answers:
                 opt = {
                     "valueCoding": {
-                        "code": ans.get("concept"),
-                        "display": ans.get("label", "Option"),
+                        "code": ans.concept,
+                        "display": ans.label if ans.label is not None else "Option",
                     }
                 }
                 # Translate Answer Options
-                if "label" in ans:
-                     self._inject_translation(opt["valueCoding"], ans["label"], is_root=False, is_display=True)
+                if ans.label is not None:
+                     self._inject_translation(opt["valueCoding"], ans.label, is_root=False, is_display=True)
                 
                 input_item["answerOption"].append(opt)
             
             # SCORING: Generate variable if score map exists
-            if "score" in q_json:
-                self._generate_score_variable(q_id, q_json["score"])
+            if q.score is not None:
+                self._generate_score_variable(q_id, q.score)
 
         # CALCULATIONS
-        if "calculate" in opts:
-            calc_expr = opts["calculate"].get("calculateExpression", "")
-            fhir_expr = self._transform_calculation(calc_expr)
+        if q.calculate is not None:
+            fhir_expr = self._transform_calculation(q.calculate)
             input_item["readOnly"] = True
             if "extension" not in input_item: input_item["extension"] = []
             
@@ -275,45 +445,40 @@ class AmpathMapper(MapperInterface):
 
         return wrapper
 
-    def _create_display_item(self, q_json):
+    def _create_display_item(self, q):
         """Map HTML/Instructions to Display items."""
-        raw_html = q_json.get("questionOptions", {}).get("html", "")
-        clean_text = re.sub('<[^<]+?>', '', raw_html) # Remove tags
+        clean_text = q.html or "" # Tags already stripped by the IR
         
         item = {
-            "linkId": str(uuid.uuid4()),
+            "linkId": self.link_prefix + self._next_id(),
             "type": "display",
             "text": clean_text
         }
         self._inject_translation(item, clean_text)
         return item
 
-    def _create_simple_input(self, q_json, fhir_type):
+    def _create_simple_input(self, q, fhir_type):
         """For non-Obs fields like Encounter Date."""
         item = {
-            "linkId": q_json.get("id"),
+            "linkId": self.link_prefix + q.id if q.id is not None else None,
             "type": fhir_type,
-            "text": q_json.get("label"),
-            "required": q_json.get("required") == "true"
+            "text": q.label,
+            "required": q.required
         }
         self._inject_translation(item, item["text"])
         return item
 
-    def _determine_fhir_type(self, q_json):
-        """Determines FHIR type checking 'rendering' option."""
-        opts = q_json.get("questionOptions", {})
-        rendering = opts.get("rendering", "")
-        
-        if rendering in ["text", "textarea"]: return "string"
-        if rendering in ["radio", "select", "ui-select-extended"]: return "choice"
-        if rendering == "number": return "integer"
-        if "answers" in opts: return "choice"
-        return "string"
+    def _stable_uuid(self, *parts):
+        return str(uuid.uuid5(ID_NAMESPACE, "/".join(parts)))
+
+    def _next_id(self):
+        """linkId for items without a source id; derived from form + position so reruns match."""
+        self.generated_ids += 1
+        return self._stable_uuid(self.form_key, str(self.generated_ids))
 
-    def _add_item_control(self, item, q_json):
+    def _add_item_control(self, item, q):
         """Adds UI hints (Radio, Text Box)."""
-        opts = q_json.get("questionOptions", {})
-        rendering = opts.get("rendering", "")
+        rendering = q.rendering
         
         code = None
         if rendering == "radio": code = "radio-button"
@@ -350,38 +515,65 @@ class AmpathMapper(MapperInterface):
         clean = ampath_calc.replace("FORM.", "")
         
         # Replace .score[x] with %xScore
-        clean = re.sub(r"(\w+)\.score\[\1\]", r"%\1Score", clean)
+        prefix = self.link_prefix
+        clean = re.sub(r"(\w+)\.score\[\1\]", lambda m: f"%{prefix}{m.group(1)}Score", clean)
         
         # Remove JS fallbacks
         clean = clean.replace(" || 0", "")
         
         return clean.strip()
 
-    def _is_display_element(self, q_json):
-        opts = q_json.get("questionOptions", {})
-        return opts.get("customControl") is True or "html" in opts
-
     def _inject_translation(self, item, text, is_root=False, is_display=False):
         """
         Looks up the text in self.translation_cache and injects the extension.
-        No API calls happen here.
+        No API calls happen here. The payload is built once per unique text
+        and the same SharedBlock is reused for every occurrence.
         """
-        if not text or text not in self.translation_cache:
+        if not text:
             return
 
-        translations = self.translation_cache[text] # {"fr": "...", "es": "..."}
-        
-        exts = []
-        for lang_code, translated_text in translations.items():
-            exts.append({
-                "url": "http://hl7.org/fhir/StructureDefinition/translation",
-                "extension": [
-                    {"url": "lang", "valueCode": lang_code},
-                    {"url": "content", "valueString": translated_text}
-                ]
-            })
-
-        if exts:
-            key = "_title" if is_root else ("_display" if is_display else "_text")
-            if key not in item: item[key] = {}
-            item[key]["extension"] = exts
\ No newline at end of file
+        block = self.translation_blocks.get(text)
+        if block is None:
+            if text not in self.translation_cache:
+                return
+            translations = self.translation_cache[text] # {"fr": "...", "es": "..."}
+
+            exts = []
+            for lang_code, translated_text in translations.items():
+                exts.append({
+                    "url": "http://hl7.org/fhir/StructureDefinition/translation",
+                    "extension": [
+                        {"url": "lang", "valueCode": lang_code},
+                        {"url": "content", "valueString": translated_text}
+                    ]
+                })
+            if not exts:
+                return
+            block = self.translation_blocks[text] = SharedBlock(extension=exts)
+
+        key = "_title" if is_root else ("_display" if is_display else "_text")
+        item[key] = block
+
+class _Unshared:
+    """A component Group seen from inside its own build (so _process_group does not recurse into the cache)."""
+    __slots__ = ("label", "is_page", "sections", "questions", "component", "prefix")
+
+    def __init__(self, group):
+        self.label = group.label
+        self.is_page = group.is_page
+        self.sections = group.sections
+        self.questions = group.questions
+        self.component = None
+        self.prefix = ""
+
+def _relink(value, prefix):
+    """Copy of a built component item with LINK_SLOT replaced by prefix. Translation blocks are shared, not copied."""
+    if isinstance(value, str):
+        return value.replace(LINK_SLOT, prefix) if LINK_SLOT in value else value
+    if isinstance(value, SharedBlock):
+        return value
+    if isinstance(value, dict):
+        return {k: _relink(v, prefix) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_relink(v, prefix) for v in value]
+    return value
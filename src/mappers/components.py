@@ -0,0 +1,169 @@
+"""
+Component forms shared through `referencedForms` (vitals, demographics...).
+
+A form lists its components as {"formName": ..., "alias": ...} and pulls in
+their pages or sections with {"reference": {"form": alias, "page": label,
+"section": label, "excludeQuestions": [ids]}}. ComponentLibrary loads each
+component from Config.components_dir once and hands out the same parsed
+part to every form that references it, so the mapper can build each part
+once and re-link it under the including form's alias. Long-running modes call
+refresh() to drop everything loaded when a component file changes.
+"""
+import hashlib
+import os
+import threading
+
+import serialization
+from metrics import metrics
+from .ir import Form, Group
+
+class ComponentLibrary:
+    def __init__(self, directory, backend="auto"):
+        self.directory = directory
+        self.backend = backend
+        self.forms = {} # formName -> Form
+        self.parts = {} # (key, alias, occurrence) -> Group
+        self._names = None # form "name" -> path, built only when a file is not named after its formName
+        self._loading = set()
+        # Mappers on several threads (pipeline, --serve) may share one library
+        self._lock = threading.RLock()
+        self._signature = _stat_signature(directory)
+        self.digest = directory_digest(directory)
+
+    def refresh(self) -> bool:
+        """Forget every loaded component if the directory's contents changed. Returns whether they did."""
+        signature = _stat_signature(self.directory)
+        with self._lock:
+            if signature == self._signature:
+                return False
+            self._signature = signature
+            digest = directory_digest(self.directory)
+            if digest == self.digest: # Touched, not edited
+                return False
+            self.digest = digest
+            self.forms.clear()
+            self.parts.clear()
+            self._names = None
+        metrics.incr("components.reloaded")
+        return True
+
+    def form(self, name) -> Form:
+        with self._lock:
+            return self._load(name)
+
+    def _load(self, name) -> Form:
+        form = self.forms.get(name)
+        if form is None:
+            if name in self._loading:
+                raise ValueError(f"Component '{name}' references itself")
+            with metrics.stage("read") as st, open(self._path(name), "rb") as f:
+                raw = f.read()
+                st.bytes = len(raw)
+            self._loading.add(name)
+            try:
+                # Components may reference other components through their own referencedForms
+                form = self.forms[name] = Form(serialization.loads(raw, self.backend), self)
+            finally:
+                self._loading.discard(name)
+            metrics.incr("components.loaded")
+        return form
+
+    def group(self, name, alias, reference, is_page, occurrence=1) -> Group:
+        """
+        The page/section a reference points to, prefixed with the including
+        form's alias; the form's second reference to the same page gets
+        '<alias>_2_', and so on.
+        """
+        excluded = tuple(reference.get("excludeQuestions") or ())
+        key = (name, reference.get("page"), reference.get("section"), excluded, is_page)
+        with self._lock:
+            part = self.parts.get((key, alias, occurrence))
+            if part is None:
+                source = self._find(name, reference.get("page"), reference.get("section"))
+                part = _restrict(source, is_page, set(excluded))
+                part.component = key
+                part.prefix = _safe_alias(alias) + ("_" if occurrence == 1 else f"_{occurrence}_")
+                self.parts[(key, alias, occurrence)] = part
+            return part
+
+    def _find(self, name, page_label, section_label) -> Group:
+        form = self.form(name)
+        page = next((p for p in form.pages if p.label == page_label), None)
+        if page is None:
+            raise ValueError(f"Component '{name}' has no page '{page_label}'")
+        if section_label is None:
+            return page
+        stack = list(page.sections)
+        section = None
+        while stack and section is None:
+            group = stack.pop(0)
+            if group.label == section_label:
+                section = group
+            stack.extend(group.sections)
+        if section is None:
+            raise ValueError(f"Component '{name}' has no section '{section_label}' on page '{page_label}'")
+        return section
+
+    def _path(self, name):
+        path = os.path.join(self.directory, name + ".json")
+        if os.path.exists(path):
+            return path
+        if self._names is None:
+            self._names = {}
+            for entry in sorted(os.scandir(self.directory), key=lambda e: e.name):
+                if entry.is_file() and entry.name.endswith(".json"):
+                    try:
+                        with open(entry.path, "rb") as f:
+                            self._names.setdefault(serialization.loads(f.read(), self.backend).get("name"), entry.path)
+                    except (OSError, ValueError, AttributeError):
+                        continue
+        if name not in self._names:
+            raise ValueError(f"Component '{name}' not found in {self.directory}")
+        return self._names[name]
+
+def _restrict(source, is_page, excluded) -> Group:
+    """A shallow Group over source's contents, without the excluded question ids."""
+    group = Group.__new__(Group)
+    group.label = source.label
+    group.is_page = is_page
+    group.prefix = source.prefix
+    group.component = source.component
+    if excluded:
+        if source.component is not None:
+            # A nested component part with questions removed is a different part
+            group.component = source.component + (tuple(sorted(excluded)),)
+        group.sections = [_restrict(s, s.is_page, excluded) for s in source.sections]
+        group.questions = [q for q in source.questions if q.id not in excluded]
+    else:
+        group.sections = source.sections
+        group.questions = source.questions
+    return group
+
+def _safe_alias(alias):
+    return "".join(c if c.isalnum() else "_" for c in str(alias))
+
+def _stat_signature(directory):
+    """Names, sizes and mtimes of the component files: a cheap check before hashing them."""
+    if not directory or not os.path.isdir(directory):
+        return None
+    signature = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(".json"):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError: # Deleted mid-scan
+                    continue
+                signature.append((entry.name, st.st_size, st.st_mtime_ns))
+    return sorted(signature)
+
+def directory_digest(directory) -> str:
+    """Content hash of every component file, so incremental runs notice edited components."""
+    digest = hashlib.sha256()
+    if directory and os.path.isdir(directory):
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            if entry.is_file() and entry.name.endswith(".json"):
+                digest.update(entry.name.encode("utf-8") + b"\0")
+                with open(entry.path, "rb") as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
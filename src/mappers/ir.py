@@ -0,0 +1,156 @@
+"""
+Compact intermediate representation of an AMPATH form.
+The raw JSON is walked exactly once by parse_form(); harvesting and the FHIR
+builders then work on these objects instead of re-reading nested dicts.
+"""
+import re
+
+TAG_RE = re.compile('<[^<]+?>')
+
+# Question kinds, decided once at parse time
+DISPLAY = "display"   # HTML / custom control -> display item
+OBS = "obs"           # Observation extraction group
+SIMPLE = "simple"     # Encounter date / provider inputs
+
+SIMPLE_TYPES = ("encounterDatetime", "encounterProvider")
+
+class Answer:
+    __slots__ = ("concept", "label")
+
+    def __init__(self, concept, label):
+        self.concept = concept
+        self.label = label
+
+class Question:
+    __slots__ = ("id", "label", "type", "kind", "fhir_type", "rendering", "required", "has_prefix", "prefix",
+                 "concept", "html", "answers", "score", "calculate")
+
+    def __init__(self, q_json):
+        opts = q_json.get("questionOptions", {})
+        self.id = q_json.get("id")
+        self.label = q_json.get("label")
+        self.type = q_json.get("type")
+        self.rendering = opts.get("rendering", "")
+        self.required = q_json.get("required") == "true"
+        self.has_prefix = "prefix" in q_json
+        self.prefix = q_json.get("prefix")
+        self.concept = opts.get("concept", "UNKNOWN-CONCEPT")
+        self.html = TAG_RE.sub('', opts["html"]) if "html" in opts else None
+        # None when the source has no 'answers' key (an empty list still yields answerOption: [])
+        self.answers = [Answer(a.get("concept"), a.get("label")) for a in opts["answers"]] if "answers" in opts else None
+        self.score = q_json.get("score")
+        self.calculate = opts["calculate"].get("calculateExpression", "") if "calculate" in opts else None
+        self.fhir_type = self._fhir_type()
+
+        if opts.get("customControl") is True or self.html is not None:
+            self.kind = DISPLAY
+        elif self.type == "obs" or "concept" in opts:
+            self.kind = OBS
+        elif self.type in SIMPLE_TYPES:
+            self.kind = SIMPLE
+        else:
+            self.kind = None # Not mapped
+
+    def _fhir_type(self):
+        """Determines FHIR type checking 'rendering' option."""
+        rendering = self.rendering
+        if rendering in ["text", "textarea"]: return "string"
+        if rendering in ["radio", "select", "ui-select-extended"]: return "choice"
+        if rendering == "number": return "integer"
+        if self.answers is not None: return "choice"
+        return "string"
+
+class Group:
+    """
+    A page or a section. Groups resolved from a component form carry the
+    component's cache key and the including form's linkId prefix; their
+    contents are shared by every form that references the same component part.
+    """
+    __slots__ = ("label", "is_page", "sections", "questions", "component", "prefix")
+
+    def __init__(self, group_json, is_page=False, resolve=None):
+        self.label = group_json.get("label", "Group")
+        self.is_page = is_page
+        self.sections = [_group(s, False, resolve) for s in group_json.get("sections", ())]
+        self.questions = [Question(q) for q in group_json.get("questions", ())]
+        self.component = None
+        self.prefix = ""
+
+def _group(group_json, is_page, resolve):
+    """A Group, or the component part a {"reference": {...}} page/section points to."""
+    if resolve is not None and "reference" in group_json:
+        return resolve(group_json["reference"], is_page)
+    return Group(group_json, is_page, resolve)
+
+class Form:
+    __slots__ = ("key", "uuid", "encounter", "display_name", "pages")
+
+    def __init__(self, source_json, components=None):
+        self.uuid = source_json.get("uuid")
+        self.encounter = source_json.get("encounter", "")
+        self.key = self.uuid or source_json.get("name") or self.encounter
+        self.display_name = source_json.get("display", self.encounter.replace("encounter.", "").upper())
+        resolve = _resolver(source_json.get("referencedForms"), components, self.key)
+        self.pages = [_group(p, True, resolve) for p in source_json.get("pages", ())]
+
+def _resolver(referenced_forms, components, form_key):
+    """resolve(reference, is_page) for a form's referencedForms (alias -> formName), or None if it has none."""
+    if not referenced_forms:
+        return None
+    aliases = {ref.get("alias"): ref.get("formName") for ref in referenced_forms}
+    included = {} # (alias, page) -> times referenced so far
+
+    def resolve(reference, is_page):
+        alias = reference.get("form")
+        if alias not in aliases:
+            raise ValueError(f"{form_key}: reference to unknown form alias '{alias}'")
+        if components is None:
+            raise ValueError(f"{form_key}: references component '{aliases[alias]}' but no components directory is configured")
+        # A page included again (whole or any section of it) gets its own linkId prefix,
+        # so its items and variables stay unique
+        place = (alias, reference.get("page"))
+        occurrence = included[place] = included.get(place, 0) + 1
+        return components.group(aliases[alias], alias, reference, is_page, occurrence)
+    return resolve
+
+def parse_form(source_json, components=None) -> Form:
+    """components (a ComponentLibrary) resolves referencedForms pages and sections."""
+    return Form(source_json, components)
+
+def iter_groups(form: Form, skip=None):
+    """Every page and (nested) section, depth first. Groups for which skip(group) is true are not entered."""
+    stack = list(reversed(form.pages))
+    while stack:
+        group = stack.pop()
+        if skip is not None and skip(group):
+            continue
+        yield group
+        stack.extend(reversed(group.sections))
+
+def iter_strings(form: Form, ignored_questions=(), skip=None):
+    """Every string the builders will look up a translation for (may include None/empty)."""
+    yield form.display_name
+    for group in iter_groups(form, skip):
+        yield group.label
+        for q in group.questions:
+            if q.kind == DISPLAY:
+                yield q.html
+            elif q.id in ignored_questions or q.kind is None:
+                continue
+            else:
+                yield q.label
+                if q.kind == OBS and q.answers:
+                    for ans in q.answers:
+                        yield ans.label
+
+def iter_concept_labels(form: Form):
+    """(label, concept_uuid) for every labelled question/answer bound to a concept."""
+    for group in iter_groups(form):
+        for q in group.questions:
+            if q.kind != OBS:
+                continue
+            if q.label and q.concept != "UNKNOWN-CONCEPT":
+                yield q.label, q.concept
+            for ans in q.answers or ():
+                if ans.label and ans.concept:
+                    yield ans.label, ans.concept
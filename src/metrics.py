@@ -0,0 +1,110 @@
+"""
+Per-stage timing and counters for the conversion pipeline.
+
+    from metrics import metrics
+    with metrics.stage("read") as st:
+        raw = f.read()
+        st.bytes = len(raw)
+    metrics.incr("translate.cache_hits", 12)
+
+Stages accumulate wall time, call counts and bytes; counters are free-form.
+Hooks registered with add_hook() receive every finished stage as a dict.
+Stages may nest (e.g. "db" lookups inside "translate"), so totals can overlap.
+"""
+import cProfile
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+class StageRecord:
+    __slots__ = ("name", "seconds", "bytes", "count", "labels")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.seconds = 0.0
+        self.bytes = 0
+        self.count = 0 # Items processed (strings, forms...), set by the caller
+        self.labels = labels
+
+    def as_event(self):
+        return {"stage": self.name, "seconds": self.seconds, "bytes": self.bytes, "count": self.count, **self.labels}
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hooks = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {} # name -> {"calls", "seconds", "bytes", "count"}
+            self.counters = {}
+
+    def add_hook(self, callback):
+        """callback(event: dict) is called after every stage, from the thread that ran it."""
+        self.hooks.append(callback)
+
+    @contextmanager
+    def stage(self, name, **labels):
+        record = StageRecord(name, labels)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+            with self._lock:
+                totals = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "bytes": 0, "count": 0})
+                totals["calls"] += 1
+                totals["seconds"] += record.seconds
+                totals["bytes"] += record.bytes
+                totals["count"] += record.count
+            for hook in self.hooks:
+                hook(record.as_event())
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "stages": {name: dict(totals) for name, totals in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+    def merge(self, snapshot):
+        """Fold in a snapshot taken elsewhere (e.g. returned by a worker process)."""
+        with self._lock:
+            for name, other in snapshot.get("stages", {}).items():
+                totals = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "bytes": 0, "count": 0})
+                for key, value in other.items():
+                    totals[key] = totals.get(key, 0) + value
+            for name, value in snapshot.get("counters", {}).items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self) -> str:
+        snap = self.snapshot()
+        parts = [f"{name} {totals['seconds']:.2f}s/{totals['calls']}" for name, totals in snap["stages"].items()]
+        return ", ".join(parts)
+
+    def write_report(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+
+@contextmanager
+def profile_to(path):
+    """Run the block under cProfile and dump stats to path (no-op when path is None)."""
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+# Process-wide default instance
+metrics = Metrics()
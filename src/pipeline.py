@@ -0,0 +1,270 @@
+"""
+Staged conversion pipeline (--pipeline):
+
+    read -> translate -> map -> write
+
+Every stage runs on its own threads (Config.pipeline_workers) and hands forms
+to the next through a bounded queue (Config.pipeline_queue_size), so a slow
+stage makes the ones before it wait instead of piling forms up in memory.
+While forms wait on the translation backend, forms whose strings are already
+translated are mapped and written, so a run takes about as long as its
+slowest stage rather than the sum of all of them. Files in an output
+directory are written in completion order; archives are written in source
+order, so their contents do not depend on timing.
+"""
+import os
+import queue
+import threading
+
+import serialization
+from archive import DirectoryWriter
+from convert import output_name
+from incremental import source_date
+from mappers.ampath import AmpathMapper
+from mappers.ir import iter_concept_labels
+from metrics import metrics, profile_to
+from validation import check_output
+
+STAGES = ("read", "translate", "map", "write")
+_DONE = object()
+
+class Job:
+    """One form on its way through the stages. Once error is set, later stages pass it along untouched."""
+    __slots__ = ("seq", "name", "raw", "mtime", "data", "harvested", "result", "untranslated", "out_name", "error")
+
+    def __init__(self, seq, name, raw=None, mtime=None):
+        self.seq = seq
+        self.name = name
+        self.raw = raw
+        self.mtime = mtime
+        self.data = None
+        self.harvested = None # (parsed form, strings) from the translation stage, reused by transform()
+        self.result = None
+        self.untranslated = 0
+        self.out_name = None
+        self.error = None
+
+class TranslationStage:
+    """
+    Translates each form's strings that are not prepared yet. A string another
+    thread is already fetching is waited for rather than requested again.
+    """
+
+    def __init__(self, mapper):
+        self.mapper = mapper
+        self._lock = threading.Lock()
+        self._in_flight = {} # text -> Event, set once the text is in shared_translations
+
+    def __call__(self, job):
+        form, strings = job.harvested = self.mapper.harvest_form(job.data)
+        claimed, waits = [], set()
+        done = threading.Event()
+        with self._lock:
+            for text in strings:
+                if text in self.mapper.prepared_strings:
+                    continue
+                event = self._in_flight.get(text)
+                if event is None:
+                    self._in_flight[text] = done
+                    claimed.append(text)
+                else:
+                    waits.add(event)
+        if claimed:
+            concept_labels = {}
+            for label, concept_uuid in iter_concept_labels(form):
+                concept_labels.setdefault(label, concept_uuid)
+            try:
+                self.mapper.translate_strings(claimed, concept_labels)
+            finally:
+                with self._lock:
+                    for text in claimed:
+                        del self._in_flight[text]
+                done.set()
+        if waits:
+            metrics.incr("pipeline.translation_waits")
+            for event in waits:
+                event.wait()
+
+class Pipeline:
+    def __init__(self, cfg, mapper, writer, profile_dir=None, sink=None):
+        self.cfg = cfg
+        self.mapper = mapper
+        self.writer = writer
+        self.profile_dir = profile_dir
+        self.sink = sink
+        self.translate = TranslationStage(mapper)
+        self._local = threading.local()
+        self._sink_lock = threading.Lock() # Uploader.add() is not thread-safe
+        self._remaining_lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self.workers = {stage: max(1, int(cfg.pipeline_workers.get(stage, 1))) for stage in STAGES}
+        # Archive writers append to one stream, in source order
+        self.ordered = not isinstance(writer, DirectoryWriter)
+        if self.ordered:
+            self.workers["write"] = 1
+        self.queue_size = max(1, cfg.pipeline_queue_size)
+        # Caps forms between the reader and the caller, including those held back for in-order writing
+        self._slots = threading.BoundedSemaphore(self.queue_size * (len(STAGES) + 1) + sum(self.workers.values()))
+
+    def _mapper(self):
+        """Mapping threads each own a mapper; translations and component caches are shared."""
+        mapper = getattr(self._local, "mapper", None)
+        if mapper is None:
+            mapper = AmpathMapper(self.cfg, self.mapper.db, self.mapper.ts)
+            mapper.shared_translations = self.mapper.shared_translations
+            mapper.prepared_strings = self.mapper.prepared_strings
+            mapper.components = self.mapper.components
+            mapper.component_items = self.mapper.component_items
+            self._local.mapper = mapper
+        return mapper
+
+    def read(self, job):
+        if job.raw is None:
+            with metrics.stage("read") as st:
+                with open(job.name, "rb") as f:
+                    job.raw = f.read()
+                st.bytes = len(job.raw)
+            job.mtime = os.path.getmtime(job.name)
+        else:
+            with metrics.stage("read") as st:
+                st.bytes = len(job.raw)
+        job.data = serialization.loads(job.raw, self.cfg.json_backend)
+        job.raw = None
+
+    def map(self, job):
+        mapper = self._mapper()
+        profile_path = os.path.join(self.profile_dir, output_name(job.name) + ".prof") if self.profile_dir else None
+        with profile_to(profile_path):
+            job.result = mapper.transform(job.data, date=source_date(job.name, job.mtime), harvested=job.harvested)
+        job.data = job.harvested = None
+        job.untranslated = len(mapper.untranslated)
+        check_output(job.result, self.cfg.validate_output, os.path.basename(job.name))
+
+    def write(self, job):
+        job.out_name = self.writer.write(job.name, job.result, int(job.mtime))
+        if self.sink:
+            with self._sink_lock:
+                self.sink(job.result, job.name)
+        job.result = None
+
+    def run(self, source):
+        """
+        Convert (name, raw bytes or None, mtime or None) items; raw None means
+        name is a file to read. Yields (name, out_name, error, untranslated) as forms finish.
+        """
+        steps = {"read": self.read, "translate": self.translate, "map": self.map, "write": self.write}
+        queues = [queue.Queue(self.queue_size) for _ in range(len(STAGES) + 1)]
+        failure = []
+        threads = [threading.Thread(target=self._feed, args=(source, queues[0], failure), daemon=True, name="pipeline-feed")]
+        for n, stage in enumerate(STAGES):
+            remaining = [self.workers[stage]] # Workers still running; the last one to finish closes the stage
+            work = self._work_in_order if stage == "write" and self.ordered else self._work
+            for i in range(self.workers[stage]):
+                threads.append(threading.Thread(
+                    target=work, args=(stage, steps[stage], queues[n], queues[n + 1], remaining),
+                    daemon=True, name=f"pipeline-{stage}-{i}"))
+        for thread in threads:
+            thread.start()
+
+        done = queues[-1]
+        try:
+            while True:
+                job = done.get()
+                if job is _DONE:
+                    break
+                self._slots.release()
+                yield job.name, job.out_name, job.error, job.untranslated
+        finally:
+            # Also reached when the caller stops early: let the threads run out
+            self._stop.set()
+        if failure:
+            raise failure[0]
+
+    def _feed(self, source, out, failure):
+        try:
+            for seq, (name, raw, mtime) in enumerate(source):
+                while not self._slots.acquire(timeout=0.1):
+                    if self._stop.is_set():
+                        return
+                if not self._put(out, Job(seq, name, raw, mtime), "feed"):
+                    return
+        except Exception as e:
+            failure.append(e)
+        finally:
+            self._put(out, _DONE, "feed")
+
+    def _work(self, stage, step, inbox, outbox, remaining):
+        while True:
+            job = self._get(inbox)
+            if job is None:
+                return
+            if job is _DONE:
+                inbox.put(_DONE) # For this stage's other workers
+                break
+            if job.error is None:
+                try:
+                    step(job)
+                except Exception as e:
+                    job.error = str(e)
+            if not self._put(outbox, job, stage):
+                return
+        with self._remaining_lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            self._put(outbox, _DONE, stage)
+
+    def _work_in_order(self, stage, step, inbox, outbox, remaining):
+        """Single worker that runs step on jobs in source order, holding back the ones that arrive early."""
+        early = {}
+        next_seq = 0
+        while True:
+            job = self._get(inbox)
+            if job is None:
+                return
+            if job is _DONE:
+                break
+            early[job.seq] = job
+            while next_seq in early:
+                job = early.pop(next_seq)
+                next_seq += 1
+                if job.error is None:
+                    try:
+                        step(job)
+                    except Exception as e:
+                        job.error = str(e)
+                if not self._put(outbox, job, stage):
+                    return
+        self._put(outbox, _DONE, stage)
+
+    def _get(self, q):
+        """Blocking get that returns None once the pipeline is stopped, so idle workers exit."""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _put(self, q, item, stage):
+        """Blocking put that gives up once the pipeline is stopped. Counts how often a full queue held a stage back."""
+        try:
+            q.put_nowait(item)
+            return True
+        except queue.Full:
+            metrics.incr(f"pipeline.{stage}.blocked")
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+def convert_pipelined(cfg, mapper, source, writer, profile_dir=None, sink=None):
+    """Run source items through a Pipeline into writer. Yields (name, out_name, error, untranslated)."""
+    pipeline = Pipeline(cfg, mapper, writer, profile_dir, sink)
+    print("Pipeline workers: " + ", ".join(f"{stage}={pipeline.workers[stage]}" for stage in STAGES)
+          + f" (queues of {pipeline.queue_size})")
+    return pipeline.run(source)
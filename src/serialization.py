@@ -0,0 +1,198 @@
+"""
+JSON input/output for forms and generated Questionnaires.
+
+Two backends: orjson when it is installed, the stdlib json module otherwise
+(Config.json_backend / --json-backend). Documents are encoded one top-level
+list element at a time (e.g. Questionnaire.item) and written through a
+buffered, optionally gzipped, binary stream, so the full output text is never
+held in memory.
+
+The mapper reuses one SharedBlock object for every occurrence of the same
+translation payload. The stdlib indented encoder renders each shared block once
+per indentation level and splices the cached text in for later occurrences, so
+output cost no longer scales with occurrences x locales; its output is
+byte-identical to json.dump(obj, fp, indent=...). orjson writes non-ASCII text
+as UTF-8 rather than \\u escapes and only supports indent=2.
+"""
+import functools
+import gzip
+import io
+import json
+from contextlib import contextmanager
+from json.encoder import encode_basestring_ascii
+
+try:
+    import orjson
+except ImportError: # Optional; stdlib is used instead
+    orjson = None
+
+BACKENDS = ("auto", "orjson", "stdlib")
+WRITE_BUFFER = 1 << 16
+GZIP_LEVEL = 6 # Same default as the gzip CLI; level 9 is several times slower for ~1% smaller output
+
+class SharedBlock(dict):
+    """A dict that may appear many times in one tree. Must not be mutated once shared."""
+    __slots__ = ()
+
+class StdlibBackend:
+    name = "stdlib"
+
+    def loads(self, raw):
+        return json.loads(raw)
+
+    def encoder(self, indent):
+        """encode(value, level) -> bytes, for the values of one document."""
+        if indent is None:
+            return lambda value, level: json.dumps(value, separators=(",", ":")).encode("utf-8")
+        return _IndentEncoder(indent).encode
+
+class OrjsonBackend:
+    name = "orjson"
+
+    def loads(self, raw):
+        return orjson.loads(raw)
+
+    def encoder(self, indent):
+        if indent is None:
+            return lambda value, level: orjson.dumps(value)
+        if indent != 2:
+            raise ValueError("The orjson backend only supports indent=2")
+
+        def encode(value, level):
+            # JSON text never contains a raw newline inside a string, so shifting every line re-nests the block
+            text = orjson.dumps(value, option=orjson.OPT_INDENT_2)
+            return text.replace(b"\n", b"\n" + b"  " * level) if level else text
+        return encode
+
+@functools.lru_cache(maxsize=None)
+def get_backend(name="auto"):
+    if name == "auto":
+        name = "orjson" if orjson else "stdlib"
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("JSON backend 'orjson' is not installed")
+        return OrjsonBackend()
+    if name == "stdlib":
+        return StdlibBackend()
+    raise ValueError(f"Unknown JSON backend: {name} (expected one of {', '.join(BACKENDS)})")
+
+def loads(raw, backend="auto"):
+    return get_backend(backend).loads(raw)
+
+def dump(obj, fp, indent=2, backend="auto"):
+    """Write obj as JSON to the binary stream fp. indent=None writes compact JSON."""
+    for chunk in iterencode(obj, indent, backend):
+        fp.write(chunk)
+
+def dumps(obj, indent=2, backend="auto") -> bytes:
+    return b"".join(iterencode(obj, indent, backend))
+
+def iterencode(obj, indent=2, backend="auto"):
+    """Yield the JSON bytes of obj in chunks, one per top-level list element."""
+    encode = get_backend(backend).encoder(indent)
+    if not isinstance(obj, dict) or isinstance(obj, SharedBlock) or not obj:
+        yield encode(obj, 0)
+        return
+
+    if indent is None:
+        inner = outer = b""
+        colon = b":"
+    else:
+        pad = b" " * indent
+        inner, outer = b"\n" + pad * 2, b"\n" + pad
+        colon = b": "
+
+    yield b"{"
+    for n, (k, v) in enumerate(obj.items()):
+        head = (b"," if n else b"") + outer + encode(k if isinstance(k, str) else str(k), 1) + colon
+        if isinstance(v, list) and v:
+            yield head + b"["
+            for i, element in enumerate(v):
+                yield (b"," if i else b"") + inner + encode(element, 2)
+            yield outer + b"]"
+        else:
+            yield head + encode(v, 1)
+    yield (b"\n" if indent is not None else b"") + b"}"
+
+@contextmanager
+def open_output(path, compress=False):
+    """Buffered binary writer for path. compress gzips it, with a zero header mtime so output is reproducible."""
+    if not compress:
+        with open(path, "wb", buffering=WRITE_BUFFER) as f:
+            yield f
+        return
+    with open(path, "wb") as raw, \
+            gzip.GzipFile(filename="", mode="wb", compresslevel=GZIP_LEVEL, fileobj=raw, mtime=0) as gz:
+        with io.BufferedWriter(gz, WRITE_BUFFER) as f:
+            yield f
+
+class _IndentEncoder:
+    """Pure-Python indented encoder that caches SharedBlock text per (block, level) for one document."""
+
+    def __init__(self, indent):
+        self.pad = " " * indent
+        self.memo = {}
+
+    def encode(self, value, level) -> bytes:
+        out = []
+        self._value(value, level, out)
+        return "".join(out).encode("utf-8")
+
+    def _value(self, value, level, out):
+        if isinstance(value, str):
+            out.append(encode_basestring_ascii(value))
+        elif value is None:
+            out.append("null")
+        elif value is True:
+            out.append("true")
+        elif value is False:
+            out.append("false")
+        elif isinstance(value, int):
+            out.append(int.__repr__(value))
+        elif isinstance(value, float):
+            out.append(json.dumps(value))
+        elif isinstance(value, dict):
+            if isinstance(value, SharedBlock):
+                key = (id(value), level)
+                text = self.memo.get(key)
+                if text is None:
+                    parts = []
+                    self._dict(value, level, parts)
+                    text = self.memo[key] = "".join(parts)
+                out.append(text)
+            else:
+                self._dict(value, level, out)
+        elif isinstance(value, (list, tuple)):
+            self._list(value, level, out)
+        else:
+            raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    def _dict(self, value, level, out):
+        if not value:
+            out.append("{}")
+            return
+        pad = self.pad
+        inner = "\n" + pad * (level + 1)
+        first = True
+        out.append("{")
+        for k, v in value.items():
+            out.append(inner if first else "," + inner)
+            first = False
+            out.append(encode_basestring_ascii(k if isinstance(k, str) else str(k)))
+            out.append(": ")
+            self._value(v, level + 1, out)
+        out.append("\n" + pad * level + "}")
+
+    def _list(self, value, level, out):
+        if not value:
+            out.append("[]")
+            return
+        pad = self.pad
+        inner = "\n" + pad * (level + 1)
+        first = True
+        out.append("[")
+        for v in value:
+            out.append(inner if first else "," + inner)
+            first = False
+            self._value(v, level + 1, out)
+        out.append("\n" + pad * level + "]")
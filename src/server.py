@@ -0,0 +1,242 @@
+"""
+Async HTTP conversion service ("preview as FHIR").
+
+    POST /transform   body: AMPATH form JSON  ->  FHIR Questionnaire JSON
+    GET  /metrics     request latency percentiles, coalescing and stage timings
+    GET  /health
+
+The event loop only does I/O. transform() runs on a small thread pool; each
+thread owns an AmpathMapper, but all of them share the DB service (and its
+concept cache), the translation service (and its memory) and one dict of
+translations, so every request warms the cache for the next. Components
+(referencedForms) are shared too and reloaded when a component file changes.
+Concurrent requests with an identical body are coalesced into a single conversion.
+"""
+import asyncio
+import collections
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serialization
+from mappers.ampath import AmpathMapper
+from mappers.components import ComponentLibrary
+from mappers.ir import iter_concept_labels
+from metrics import metrics
+from validation import ValidationError, check_output
+
+MAX_BODY = 16 * 1024 * 1024
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               411: "Length Required", 413: "Payload Too Large", 417: "Expectation Failed",
+               422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+class BadRequest(ValueError):
+    """The request body is not a JSON object."""
+
+class LatencyWindow:
+    """Percentiles over the most recent request latencies."""
+
+    def __init__(self, size=1000):
+        self.samples = collections.deque(maxlen=size)
+        self.total = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.total += 1
+
+    def summary(self) -> dict:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {"requests": self.total}
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+        return {"requests": self.total, "window": len(ordered),
+                "p50_ms": pct(0.50), "p90_ms": pct(0.90), "p99_ms": pct(0.99), "max_ms": pct(1.0)}
+
+class ConversionServer:
+    def __init__(self, config, db_service, trans_service, workers=4):
+        self.config = config
+        self.db = db_service
+        self.ts = trans_service
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="transform")
+        # Shared by every thread's mapper
+        self.shared_translations = {}
+        self.prepared_strings = set()
+        components_dir = getattr(config, "components_dir", None)
+        self.components = ComponentLibrary(components_dir, config.json_backend) if components_dir else None
+        self.component_items = {}
+        self._local = threading.local()
+        self.in_flight = {} # body hash -> asyncio.Task, touched only from the event loop
+        self.latency = LatencyWindow()
+        self.coalesced = 0
+        self.errors = 0
+
+    def _mapper(self):
+        mapper = getattr(self._local, "mapper", None)
+        if mapper is None:
+            mapper = AmpathMapper(self.config, self.db, self.ts)
+            mapper.shared_translations = self.shared_translations
+            mapper.prepared_strings = self.prepared_strings
+            mapper.components = self.components
+            mapper.component_items = self.component_items
+            self._local.mapper = mapper
+        return mapper
+
+    def _convert(self, body) -> bytes:
+        """Runs on a worker thread: parse, translate what is new, transform, encode."""
+        try:
+            data = serialization.loads(body, self.config.json_backend)
+        except ValueError as e:
+            raise BadRequest(f"Invalid JSON: {e}") from e
+        if not isinstance(data, dict):
+            raise BadRequest("Expected a JSON object")
+        mapper = self._mapper()
+        mapper.refresh_components()
+        # Harvest once and hand the result to transform() so the form is not parsed twice
+        form, strings = mapper.harvest_form(data)
+        if strings:
+            concept_labels = {}
+            for label, concept_uuid in iter_concept_labels(form):
+                concept_labels.setdefault(label, concept_uuid)
+            mapper.translate_strings(strings, concept_labels)
+        result = mapper.transform(data, harvested=(form, strings))
+        check_output(result, self.config.validate_output, "request")
+        return serialization.dumps(result, None, self.config.json_backend)
+
+    async def convert(self, body) -> bytes:
+        key = hashlib.sha256(body).hexdigest()
+        task = self.in_flight.get(key)
+        if task is None:
+            loop = asyncio.get_running_loop()
+            task = asyncio.ensure_future(loop.run_in_executor(self.executor, self._convert, body))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+            metrics.incr("serve.coalesced")
+        # shield: one client disconnecting must not cancel the conversion others wait on
+        return await asyncio.shield(task)
+
+    def metrics_report(self) -> dict:
+        return {
+            "latency": self.latency.summary(),
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "in_flight": len(self.in_flight),
+            "cached_translations": len(self.shared_translations),
+            **metrics.snapshot(),
+        }
+
+    async def route(self, method, path, body):
+        """Returns (status, body bytes)."""
+        path = path.split("?", 1)[0]
+        if path == "/transform":
+            if method != "POST":
+                return 405, _error("Use POST")
+            try:
+                return 200, await self.convert(body)
+            except BadRequest as e:
+                return 400, _error(str(e))
+            except ValidationError as e:
+                return 422, json.dumps({"error": str(e), "issues": e.issues}).encode("utf-8")
+            except ValueError as e: # The mapper rejected the form
+                return 422, _error(f"Invalid form: {e}")
+            except Exception as e:
+                return 500, _error(f"Conversion failed: {e}")
+        if path == "/metrics" and method == "GET":
+            return 200, json.dumps(self.metrics_report()).encode("utf-8")
+        if path == "/health" and method == "GET":
+            return 200, b'{"status":"ok"}'
+        return 404, _error(f"No route for {method} {path}")
+
+    async def handle_connection(self, reader, writer):
+        """HTTP/1.1 with keep-alive; requests need a Content-Length (no chunked bodies)."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await _respond(writer, 400, _error("Malformed request line"), close=True)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+                length = headers.get("content-length")
+                if method == "POST" and length is None:
+                    await _respond(writer, 411, _error("Content-Length required"), close=True)
+                    break
+                try:
+                    length = int(length or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await _respond(writer, 400, _error("Invalid Content-Length"), close=True)
+                    break
+                if length > MAX_BODY:
+                    await _respond(writer, 413, _error(f"Body exceeds {MAX_BODY} bytes"), close=True)
+                    break
+                expect = headers.get("expect", "").lower()
+                if expect:
+                    if expect != "100-continue":
+                        await _respond(writer, 417, _error(f"Unsupported Expect: {expect}"), close=True)
+                        break
+                    if version == "HTTP/1.1":
+                        # The client waits for this before sending the body
+                        writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                        await writer.drain()
+                body = await reader.readexactly(length) if length else b""
+
+                start = time.perf_counter()
+                with metrics.stage("serve") as st:
+                    status, payload = await self.route(method, path, body)
+                    st.bytes = len(payload)
+                if path.startswith("/transform"):
+                    self.latency.add(time.perf_counter() - start)
+                    if status >= 400:
+                        self.errors += 1
+                await _respond(writer, status, payload, close=not keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8000, ready=None):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        bound = server.sockets[0].getsockname()
+        print(f"Serving on http://{bound[0]}:{bound[1]} (POST /transform, GET /metrics)")
+        if ready:
+            ready(bound)
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host="127.0.0.1", port=8000):
+        try:
+            asyncio.run(self.serve(host, port))
+        except KeyboardInterrupt:
+            print("Stopping server.")
+        finally:
+            self.executor.shutdown(wait=True)
+
+def _error(message) -> bytes:
+    return json.dumps({"error": message}).encode("utf-8")
+
+async def _respond(writer, status, payload, close=False):
+    head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n")
+    writer.write(head.encode("latin-1") + payload)
+    await writer.drain()
@@ -0,0 +1,28 @@
+# Backends are imported only when selected, so e.g. a mock run never loads the Gemini SDK
+def _gemini(config):
+    from .gemini import GeminiTranslationService
+    return GeminiTranslationService(
+        config.gemini_api_key,
+        requests_per_minute=config.gemini_requests_per_minute,
+        tokens_per_minute=config.gemini_tokens_per_minute,
+        max_in_flight=config.gemini_max_in_flight,
+        chunk_tokens=config.gemini_chunk_tokens,
+        max_chunk_strings=config.gemini_max_chunk_strings,
+        retries=config.gemini_retries,
+        backoff=config.gemini_retry_backoff,
+        breaker_threshold=config.gemini_breaker_threshold,
+        breaker_cooldown=config.gemini_breaker_cooldown,
+    )
+
+def _mock(config):
+    from .mock import MockTranslationService
+    return MockTranslationService()
+
+BACKENDS = {"gemini": _gemini, "mock": _mock}
+
+def create_translation_service(config, backend=None):
+    """Build the translation backend named by 'backend' or Config.translation_backend."""
+    backend = backend or getattr(config, "translation_backend", "gemini")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown translation backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[backend](config)
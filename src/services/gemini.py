@@ -1,64 +1,290 @@
 import google.generativeai as genai
 import json
+import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
+from metrics import metrics
 from .base import TranslationInterface
+from .ratelimit import RateLimiter, estimate_tokens
+
+MAX_BACKOFF = 60.0
+
+# How a request failed: decides whether it is retried and whether its chunk is split
+TIMEOUT = "timeout"     # Retried, then split: long chunks can time out where halves succeed
+TRANSIENT = "transient" # 429, 5xx, unknown errors: retried, but halves would fail the same way
+FATAL = "fatal"         # Auth, other 4xx, connection refused/reset: not retried, the chunk is dropped
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+def failure_kind(error):
+    """Classify a generate_content() exception (google.api_core errors carry the HTTP status as .code)."""
+    code = getattr(error, "code", None)
+    code = code if isinstance(code, int) else None
+    if isinstance(error, TimeoutError) or code in (408, 504) or "DeadlineExceeded" in type(error).__name__:
+        return TIMEOUT
+    if isinstance(error, CircuitOpenError) or isinstance(error, ConnectionError):
+        return FATAL
+    if code is not None and 400 <= code < 500 and code != 429:
+        return FATAL
+    return TRANSIENT
 
 class GeminiTranslationService(TranslationInterface):
-    def __init__(self, api_key):
-        self.model = None
-        if api_key and "YOUR_KEY" not in api_key:
+    MODEL_NAME = 'gemini-2.5-flash'
+    # Bump whenever the prompt changes so cached translations get invalidated
+    PROMPT_VERSION = "2"
+
+    def __init__(self, api_key, requests_per_minute=60, tokens_per_minute=None, max_in_flight=4, model=None,
+                 chunk_tokens=4000, max_chunk_strings=50, retries=3, backoff=1.0,
+                 breaker_threshold=5, breaker_cooldown=60.0):
+        """
+        model: anything exposing generate_content(prompt) -> obj.text.
+               Defaults to the real Gemini model; pass a fake for local testing.
+        chunk_tokens: estimated prompt + response tokens per request; chunks are packed up to this budget.
+        retries: attempts per chunk after the first, with exponential backoff starting at 'backoff' seconds.
+        breaker_threshold: after this many consecutive requests raised, no request is sent for
+            'breaker_cooldown' seconds and the chunks meanwhile are dropped.
+        """
+        self.model = model
+        self.version = f"{self.MODEL_NAME}/p{self.PROMPT_VERSION}"
+        self.max_in_flight = max(1, max_in_flight)
+        # Caps requests across every caller (pipeline threads, server workers), not just within one batch
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self.chunk_tokens = chunk_tokens
+        self.max_chunk_strings = max(1, max_chunk_strings)
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.breaker_threshold = max(1, breaker_threshold)
+        self.breaker_cooldown = breaker_cooldown
+        self._breaker_lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        if self.model is None and api_key and "YOUR_KEY" not in api_key:
             genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-2.5-flash')
+            self.model = genai.GenerativeModel(self.MODEL_NAME)
 
     def batch_translate(self, texts: List[str], target_locales: List[str]) -> Dict[str, Dict[str, str]]:
         if not self.model or not texts:
             return {}
 
-        # Deduplicate and remove empties
-        unique_texts = list(set([t for t in texts if t and t.strip()]))
+        # Deduplicate and remove empties (keeping order, so chunking is deterministic)
+        unique_texts = list(dict.fromkeys(t for t in texts if t and t.strip()))
         translation_map = {}
-        
-        # Chunking: Send 20-30 strings per prompt to avoid token limits/timeouts
-        CHUNK_SIZE = 25 
-        
-        print(f"   [Gemini] Batching {len(unique_texts)} strings into {len(unique_texts)//CHUNK_SIZE + 1} requests...")
 
-        for i in range(0, len(unique_texts), CHUNK_SIZE):
-            chunk = unique_texts[i:i + CHUNK_SIZE]
-            self._process_chunk(chunk, target_locales, translation_map)
-            time.sleep(1)
+        chunks = self._make_chunks(unique_texts, target_locales)
+
+        print(f"   [Gemini] Batching {len(unique_texts)} strings into {len(chunks)} requests "
+              f"({self.max_in_flight} in flight)...")
+
+        # Requests run concurrently, paced by the rate limiter instead of a fixed sleep.
+        # Results are merged in chunk order so the output does not depend on timing.
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            for data in pool.map(lambda chunk: self._translate_chunk(chunk, target_locales), chunks):
+                translation_map.update(data)
 
         return translation_map
 
-    def _process_chunk(self, chunk, locales, result_map):
-        prompt = f"""
-        You are a medical translator. Translate the following list of strings into these languages: {', '.join(locales)}.
-        
-        Input Strings:
-        {json.dumps(chunk)}
+    def _make_chunks(self, texts, locales):
+        """
+        Pack strings into chunks by estimated tokens: each string is sent once
+        and comes back once per locale. A string over the budget on its own
+        gets a chunk to itself.
+        """
+        chunks, current, used = [], [], 0
+        for text in texts:
+            cost = estimate_tokens(text) * (len(locales) + 1)
+            if current and (used + cost > self.chunk_tokens or len(current) >= self.max_chunk_strings):
+                chunks.append(current)
+                current, used = [], 0
+            current.append(text)
+            used += cost
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _translate_chunk(self, chunk, locales, retries=None):
+        """
+        Translate one chunk, keeping every valid entry of the response. Strings
+        still missing are asked for again: on their own if the response was
+        partial, otherwise split in half, recursively, until a string that
+        keeps failing is isolated and dropped.
+        Requests that raise are only split when they timed out (halves get no
+        retries of their own). Other errors are retried with backoff (429/5xx)
+        or not at all (auth, 4xx, connection), and then the chunk is dropped,
+        so an outage costs a few requests per chunk rather than one per string.
+        """
+        retries = self.retries if retries is None else retries
+        ids = {str(n): text for n, text in enumerate(chunk, 1)}
+        prompt = self._build_prompt(ids, locales)
+        kind = None
+        for attempt in range(retries + 1):
+            text, result, kind = None, {}, None
+            try:
+                text = self._dispatch(chunk, locales, prompt)
+                result = self._valid_entries(_parse_partial(text), ids, locales)
+            except Exception as e:
+                kind = failure_kind(e)
+                if not isinstance(e, CircuitOpenError):
+                    metrics.incr("translate.chunk_failures")
+                    print(f"   [Gemini] Chunk of {len(chunk)} strings failed ({kind}): {str(e)}")
+            # Larger chunks with a bad reply are split below rather than sent again as they are
+            if text is not None and (result or len(chunk) > 1):
+                break
+            if kind == FATAL:
+                break
+            if attempt < retries:
+                metrics.incr("translate.retries")
+                time.sleep(min(MAX_BACKOFF, self.backoff * 2 ** attempt))
+        missing = [t for t in chunk if t not in result]
+        if not missing:
+            return result
+
+        if result:
+            metrics.incr("translate.salvaged", len(result))
+        if len(chunk) == 1 or kind in (FATAL, TRANSIENT):
+            metrics.incr("translate.dropped_strings", len(missing))
+            if kind != FATAL or not self._breaker_open():
+                print(f"   [Gemini] Giving up on {len(missing)} strings")
+            return result
+
+        if kind == TIMEOUT:
+            metrics.incr("translate.splits")
+            half = len(chunk) // 2
+            for part in (chunk[:half], chunk[half:]):
+                result.update(self._translate_chunk(part, locales, retries=0))
+            return result
+
+        if len(missing) < len(chunk):
+            parts = [missing]
+        else:
+            metrics.incr("translate.splits")
+            half = len(missing) // 2
+            parts = [missing[:half], missing[half:]]
+        for part in parts:
+            result.update(self._translate_chunk(part, locales))
+        return result
+
+    def _dispatch(self, chunk, locales, prompt):
+        if self._breaker_open():
+            raise CircuitOpenError("circuit breaker open")
+        # Budget covers the prompt plus the expected output (each string once per locale)
+        expected_output = sum(estimate_tokens(t) for t in chunk) * len(locales)
+        with metrics.stage("translate.throttle"):
+            self.limiter.acquire(estimate_tokens(prompt) + expected_output)
+            self._slots.acquire()
+        metrics.incr("translate.chunks")
+        try:
+            with metrics.stage("translate.request") as st:
+                st.bytes = len(prompt)
+                st.count = len(chunk)
+                response = self.model.generate_content(prompt)
+                text = response.text
+        except Exception:
+            self._record_failure()
+            raise
+        finally:
+            self._slots.release()
+        with self._breaker_lock:
+            self._consecutive_failures = 0
+        metrics.incr("translate.response_bytes", len(text))
+        return text
+
+    def _breaker_open(self):
+        return time.monotonic() < self._open_until
+
+    def _record_failure(self):
+        """Open the breaker once breaker_threshold requests in a row have raised; it closes on the next success."""
+        with self._breaker_lock:
+            self._consecutive_failures += 1
+            if self._consecutive_failures < self.breaker_threshold or self._breaker_open():
+                return
+            # Past the cooldown one more failing request re-opens it straight away
+            self._open_until = time.monotonic() + self.breaker_cooldown
+        metrics.incr("translate.breaker_trips")
+        print(f"   [Gemini] {self._consecutive_failures} requests failed in a row; "
+              f"dropping requests for {self.breaker_cooldown:.0f}s")
+
+    def _valid_entries(self, data, ids, locales):
+        """
+        Map {id: [one translation per locale, in order]} (or {id: {locale: text}})
+        back to source strings, keeping only requested ids with every locale present.
+        """
+        valid = {}
+        for key, translations in data.items():
+            source = ids.get(str(key).strip())
+            if source is None:
+                continue
+            if isinstance(translations, dict):
+                translations = [translations.get(loc) for loc in locales]
+            if isinstance(translations, list) and len(translations) == len(locales) \
+                    and all(isinstance(t, str) for t in translations):
+                valid[source] = dict(zip(locales, translations))
+        return valid
+
+    def _build_prompt(self, ids, locales):
+        """
+        Strings go out keyed by short numeric ids and come back as
+        {id: [translations]}, so the model never echoes the (often long) source
+        text and replies are matched by id rather than by exact string.
+        """
+        return f"""
+        You are a medical translator. Translate each input string into these languages, in this order: {', '.join(locales)}.
+
+        Input (JSON object of id -> string):
+        {json.dumps(ids, ensure_ascii=False, separators=(',', ':'))}
 
         Requirements:
         1. Return ONLY valid JSON. No markdown, no code blocks, no text before/after.
-        2. Structure: {{"Source String": {{"lang_code": "Translated String", ...}}, ...}}
-        3. If a term is technical or untranslatable, keep it in English.
+        2. Structure: {{"id": ["translation", ...], ...}} with one entry per input id and one translation per language, in the order listed above.
+        3. Do not repeat the input strings.
+        4. If a term is technical or untranslatable, keep it in English.
         """
 
-        try:
-            response = self.model.generate_content(prompt)
-            clean_text = response.text.strip()
-            
-            # Clean up if Gemini adds markdown code blocks accidentally
-            if clean_text.startswith("```json"):
-                clean_text = clean_text[7:-3]
-            elif clean_text.startswith("```"):
-                clean_text = clean_text[3:-3]
-
-            data = json.loads(clean_text)
-            
-            # Merge into main result
-            result_map.update(data)
-            
-        except Exception as e:
-            print(f"   [Gemini] Chunk failed: {str(e)}")
-            # Fallback: Do nothing (result_map remains empty for these keys, code handles missing keys gracefully)
\ No newline at end of file
+_WHITESPACE = re.compile(r"\s*")
+
+def _parse_partial(text) -> dict:
+    """
+    Parse the response object. If it is cut off or malformed part way, keep
+    every complete top-level "key": value pair before the damage.
+    """
+    text = text.strip()
+    # Clean up if Gemini adds markdown code blocks accidentally
+    if text.startswith("```"):
+        text = text[3:]
+        if text.startswith("json"):
+            text = text[4:]
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
+    try:
+        data = json.loads(text)
+        return data if isinstance(data, dict) else {}
+    except ValueError:
+        pass
+
+    decoder = json.JSONDecoder()
+    result = {}
+    pos = text.find("{")
+    if pos < 0:
+        return result
+    pos += 1
+    try:
+        while True:
+            pos = _WHITESPACE.match(text, pos).end()
+            key, pos = decoder.raw_decode(text, pos)
+            pos = _WHITESPACE.match(text, pos).end()
+            if text[pos:pos + 1] != ":":
+                break
+            pos = _WHITESPACE.match(text, pos + 1).end()
+            value, pos = decoder.raw_decode(text, pos)
+            if isinstance(key, str):
+                result[key] = value
+            pos = _WHITESPACE.match(text, pos).end()
+            if text[pos:pos + 1] != ",":
+                break
+            pos += 1
+    except ValueError:
+        pass
+    return result
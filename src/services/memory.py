@@ -0,0 +1,162 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Dict
+from metrics import metrics
+from .base import TranslationInterface
+
+# SQLite caps the number of bound parameters per statement (999 on older builds)
+LOOKUP_BATCH = 500
+
+
+class TranslationMemory:
+    """
+    Persistent store of translated strings, keyed by (source, locale, version).
+    'version' identifies the model/prompt that produced the translation so a
+    model upgrade can invalidate old entries without touching the rest. Each
+    version's last use is kept, so versions nobody uses any more can be evicted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS translation (
+                source TEXT NOT NULL,
+                locale TEXT NOT NULL,
+                version TEXT NOT NULL,
+                target TEXT NOT NULL,
+                PRIMARY KEY (version, source, locale)
+            ) WITHOUT ROWID
+        """)
+        tracked = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'version_use'").fetchone()
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS version_use (
+                version TEXT PRIMARY KEY,
+                last_used REAL NOT NULL
+            )
+        """)
+        if not tracked:
+            # Memories from before usage tracking: their versions start aging now
+            self.conn.execute("INSERT OR IGNORE INTO version_use SELECT DISTINCT version, ? FROM translation", (time.time(),))
+        self.conn.commit()
+
+    def lookup(self, texts: List[str], locales: List[str], version: str) -> Dict[str, Dict[str, str]]:
+        """Return {source: {locale: target}} for every stored entry among texts/locales."""
+        found = {}
+        if not texts or not locales:
+            return found
+
+        loc_marks = ",".join("?" * len(locales))
+        with self._lock:
+            for i in range(0, len(texts), LOOKUP_BATCH):
+                batch = texts[i:i + LOOKUP_BATCH]
+                query = f"""
+                    SELECT source, locale, target FROM translation
+                    WHERE version = ? AND locale IN ({loc_marks})
+                    AND source IN ({",".join("?" * len(batch))})
+                """
+                for source, locale, target in self.conn.execute(query, [version, *locales, *batch]):
+                    found.setdefault(source, {})[locale] = target
+        return found
+
+    def store(self, translations: Dict[str, Dict[str, str]], version: str):
+        rows = [
+            (source, locale, version, target)
+            for source, per_locale in translations.items()
+            if isinstance(per_locale, dict)
+            for locale, target in per_locale.items()
+            if isinstance(target, str)
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO translation (source, locale, version, target) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.commit()
+
+    def invalidate(self, version: str) -> int:
+        """Drop every entry produced by the given model/prompt version."""
+        with self._lock:
+            cur = self.conn.execute("DELETE FROM translation WHERE version = ?", (version,))
+            self.conn.commit()
+        return cur.rowcount
+
+    def touch(self, version: str):
+        """Mark version as in use, so evict() keeps it."""
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO version_use (version, last_used) VALUES (?, ?)",
+                              (version, time.time()))
+            self.conn.commit()
+
+    def evict(self, keep_version: str, max_age_days: float) -> int:
+        """Drop the entries of versions other than keep_version that nobody has used for max_age_days."""
+        cutoff = time.time() - max_age_days * 86400
+        with self._lock:
+            stale = [row[0] for row in self.conn.execute(
+                "SELECT version FROM version_use WHERE version != ? AND last_used < ?", (keep_version, cutoff))]
+            removed = 0
+            for version in stale:
+                removed += self.conn.execute("DELETE FROM translation WHERE version = ?", (version,)).rowcount
+                self.conn.execute("DELETE FROM version_use WHERE version = ?", (version,))
+            self.conn.commit()
+        return removed
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class CachedTranslationService(TranslationInterface):
+    """
+    Wraps any TranslationInterface with a TranslationMemory.
+    Only strings missing from the memory (for any requested locale) reach the backend.
+    """
+
+    def __init__(self, backend: TranslationInterface, memory: TranslationMemory, version=None):
+        self.backend = backend
+        self.memory = memory
+        self.version = version or getattr(backend, "version", type(backend).__name__)
+        self.memory.touch(self.version)
+        self.hits = 0
+        self.misses = 0
+
+    def batch_translate(self, texts: List[str], target_locales: List[str]) -> Dict[str, Dict[str, str]]:
+        unique_texts = list(dict.fromkeys(t for t in texts if t and t.strip()))
+        if not unique_texts:
+            return {}
+
+        stored = self.memory.lookup(unique_texts, target_locales, self.version)
+
+        result = {}
+        missing = []
+        for text in unique_texts:
+            entry = stored.get(text)
+            if entry and len(entry) == len(target_locales):
+                result[text] = {loc: entry[loc] for loc in target_locales}
+            else:
+                missing.append(text)
+
+        self.hits += len(result)
+        self.misses += len(missing)
+        metrics.incr("translate.cache_hits", len(result))
+        metrics.incr("translate.cache_misses", len(missing))
+        print(f"   [Memory] {len(result)} hits, {len(missing)} misses")
+
+        if missing:
+            fresh = self.backend.batch_translate(missing, target_locales)
+            self.memory.store(fresh, self.version)
+            result.update(fresh)
+
+        return result
+
+    def evict_stale(self, max_age_days: float) -> int:
+        return self.memory.evict(self.version, max_age_days)
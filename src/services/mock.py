@@ -1,11 +1,39 @@
+import json
+import re
+import time
 from typing import List, Dict
 from .base import TranslationInterface
 
 class MockTranslationService(TranslationInterface):
+    version = "mock"
+
     def batch_translate(self, texts: List[str], target_locales: List[str]) -> Dict[str, Dict[str, str]]:
         result = {}
         for text in texts:
             result[text] = {}
             for loc in target_locales:
                 result[text][loc] = f"[{loc}] {text}"
-        return result
\ No newline at end of file
+        return result
+
+class MockGenerativeModel:
+    """
+    Local stand-in for genai.GenerativeModel with injected latency.
+    Usage: GeminiTranslationService(None, model=MockGenerativeModel(latency=0.5))
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        time.sleep(self.latency)
+        locales = re.search(r"in this order: (.*)\.", prompt).group(1).split(", ")
+        strings = json.loads(re.search(r"Input \(.*\):\s*(\{.*\})", prompt).group(1))
+        translated = MockTranslationService().batch_translate(list(strings.values()), locales)
+        reply = {key: [translated[text][loc] for loc in locales] for key, text in strings.items()}
+        return _MockResponse(json.dumps(reply, ensure_ascii=False, separators=(",", ":")))
+
+class _MockResponse:
+    def __init__(self, text):
+        self.text = text
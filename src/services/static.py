@@ -0,0 +1,16 @@
+from typing import List, Dict
+from .base import TranslationInterface
+
+class StaticTranslationService(TranslationInterface):
+    """Serves translations from a precomputed map (e.g. a corpus pass done elsewhere). Never calls out."""
+
+    def __init__(self, translations: Dict[str, Dict[str, str]]):
+        self.translations = translations
+
+    def batch_translate(self, texts: List[str], target_locales: List[str]) -> Dict[str, Dict[str, str]]:
+        result = {}
+        for text in texts:
+            entry = self.translations.get(text)
+            if entry:
+                result[text] = {loc: entry[loc] for loc in target_locales if loc in entry}
+        return result
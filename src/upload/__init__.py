@@ -0,0 +1,14 @@
+def create_uploader(config):
+    """FhirUploader for Config.fhir_base_url, or None when uploading is off."""
+    if not getattr(config, "fhir_base_url", None):
+        return None
+    from .uploader import FhirUploader
+    return FhirUploader(
+        config.fhir_base_url,
+        bundle_type=config.fhir_bundle_type,
+        bundle_size=config.fhir_bundle_size,
+        max_in_flight=config.fhir_max_in_flight,
+        retries=config.fhir_retries,
+        headers=config.fhir_headers,
+        json_backend=config.json_backend,
+    )
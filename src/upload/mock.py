@@ -0,0 +1,160 @@
+"""
+Local stub FHIR server for exercising the uploader without a real server.
+
+    server = StubFhirServer(fail_first=2).start()
+    uploader = FhirUploader(server.base_url)
+    ...
+    server.stop()
+    server.resources[("Questionnaire", "abc")]
+
+Or standalone: python src/upload/mock.py --port 8080
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubFhirServer:
+    """
+    Accepts transaction/batch Bundles of PUT entries at the base URL and keeps
+    resources in memory. fail_first answers that many requests with 503 to
+    exercise retries; latency delays every response.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, base_path="/fhir", fail_first=0, latency=0.0):
+        self.base_path = base_path.rstrip("/")
+        self.fail_first = fail_first
+        self.latency = latency
+        self.resources = {} # (resourceType, id) -> resource
+        self.requests = 0
+        self.bundles = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _handler_for(self))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{self.base_path}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def handle(self, method, path, body):
+        """Returns (status, response body dict or None, extra headers)."""
+        with self._lock:
+            self.requests += 1
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return 503, None, {"Retry-After": "0"}
+        time.sleep(self.latency)
+
+        if not path.startswith(self.base_path):
+            return 404, _outcome("not-found", path), {}
+        path = path[len(self.base_path):].strip("/")
+
+        if method == "POST" and not path:
+            return self._bundle(body)
+        if method == "PUT" and path.count("/") == 1:
+            return self._put(path, body)
+        if method == "GET" and path.count("/") == 1:
+            resource = self.resources.get(tuple(path.split("/")))
+            return (200, resource, {}) if resource else (404, _outcome("not-found", path), {})
+        return 405, _outcome("not-supported", f"{method} {path}"), {}
+
+    def _bundle(self, bundle):
+        if not bundle or bundle.get("resourceType") != "Bundle" or bundle.get("type") not in ("transaction", "batch"):
+            return 400, _outcome("invalid", "Expected a transaction or batch Bundle"), {}
+        with self._lock:
+            self.bundles += 1
+        entries = bundle.get("entry", [])
+        valid = [_valid_put(e) for e in entries]
+        if bundle["type"] == "transaction" and not all(valid):
+            # All or nothing: nothing is stored
+            return 400, _outcome("processing", f"Entry {valid.index(False)} is not a PUT of a matching resource"), {}
+        statuses = [self._put(e["request"]["url"], e["resource"])[0] if ok else 400 for e, ok in zip(entries, valid)]
+        reply = [{"response": {"status": _STATUS_TEXT[status]}} for status in statuses]
+        return 200, {"resourceType": "Bundle", "type": bundle["type"] + "-response", "entry": reply}, {}
+
+    def _put(self, url, resource):
+        resource_type, resource_id = url.split("/")
+        if not resource or resource.get("resourceType") != resource_type or resource.get("id") != resource_id:
+            return 400, _outcome("invalid", f"Body does not match {url}"), {}
+        with self._lock:
+            created = (resource_type, resource_id) not in self.resources
+            self.resources[(resource_type, resource_id)] = resource
+        return (201 if created else 200), resource, {}
+
+_STATUS_TEXT = {200: "200 OK", 201: "201 Created", 400: "400 Bad Request"}
+
+def _valid_put(entry):
+    url = entry.get("request", {}).get("url", "")
+    resource = entry.get("resource") or {}
+    return (entry.get("request", {}).get("method") == "PUT" and url.count("/") == 1
+            and url == f"{resource.get('resourceType')}/{resource.get('id')}")
+
+def _outcome(code, text):
+    return {"resourceType": "OperationOutcome", "issue": [{"severity": "error", "code": code, "diagnostics": text}]}
+
+def _handler_for(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Keep-alive
+        wbufsize = 1 << 16 # Headers and body in one send, avoiding Nagle/delayed-ACK stalls
+
+        def setup(self):
+            super().setup()
+            with server._lock:
+                server.connections += 1
+
+        def _dispatch(self, method):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            try:
+                body = json.loads(raw) if raw else None
+            except ValueError:
+                status, reply, headers = 400, _outcome("invalid", "Body is not JSON"), {}
+            else:
+                status, reply, headers = server.handle(method, self.path, body)
+            data = json.dumps(reply).encode("utf-8") if reply is not None else b""
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/fhir+json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_PUT(self):
+            self._dispatch("PUT")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub FHIR server for upload testing.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--fail-first", type=int, default=0, help="Answer the first N requests with 503")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to delay every response")
+    args = parser.parse_args()
+    stub = StubFhirServer(port=args.port, fail_first=args.fail_first, latency=args.latency)
+    print(f"Stub FHIR server at {stub.base_url}")
+    try:
+        stub.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Stored {len(stub.resources)} resources from {stub.bundles} bundles")
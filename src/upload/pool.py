@@ -0,0 +1,71 @@
+import http.client
+import queue
+import threading
+from urllib.parse import urlsplit
+
+# Errors that mean a reused keep-alive connection was closed by the server while idle
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+class ConnectionPool:
+    """
+    Thread-safe pool of keep-alive HTTP(S) connections to one host.
+    At most 'size' requests are in flight; idle connections are reused.
+    """
+
+    def __init__(self, base_url, size=4, timeout=30):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {base_url}")
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.opened = 0 # Connections created, for keep-alive diagnostics
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max(1, size))
+
+    def _connect(self):
+        self.opened += 1
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None, headers=None):
+        """Send one request. Returns (status, headers (case-insensitive), body bytes); raises OSError/HTTPException on transport errors."""
+        url = self.base_path + "/" + path.lstrip("/") if path else self.base_path or "/"
+        with self._slots:
+            try:
+                conn, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self._connect(), False
+            try:
+                return self._send(conn, method, url, body, headers)
+            except STALE_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+                # The server dropped the idle connection; retry once on a fresh one
+                conn = self._connect()
+                return self._send(conn, method, url, body, headers)
+
+    def _send(self, conn, method, url, body, headers):
+        try:
+            conn.request(method, url, body=body, headers=headers or {})
+            response = conn.getresponse()
+            data = response.read()
+        except BaseException:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._idle.put(conn)
+        return response.status, response.headers, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,162 @@
+import http.client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import serialization
+from metrics import metrics
+from .pool import ConnectionPool
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_BACKOFF = 30.0
+
+class FhirUploader:
+    """
+    Groups resources into FHIR transaction/batch Bundles and POSTs them to a
+    FHIR server base URL. Each entry is a PUT to <type>/<id> (update-as-create),
+    so uploading the same Questionnaires again replaces them instead of duplicating.
+
+        uploader = FhirUploader("http://localhost:8080/fhir", bundle_size=50)
+        uploader.add(questionnaire)
+        uploader.close() # flushes and waits for in-flight bundles
+
+    A 'transaction' Bundle succeeds or fails as a whole; in a 'batch' each entry
+    succeeds or fails on its own. Resources added with a key have that key put
+    in `accepted` once the server has stored them.
+    """
+
+    def __init__(self, base_url, bundle_type="transaction", bundle_size=50, max_in_flight=4,
+                 retries=3, backoff=0.5, timeout=30, headers=None, json_backend="auto"):
+        if bundle_type not in ("transaction", "batch"):
+            raise ValueError(f"Unknown bundle type: {bundle_type}")
+        self.base_url = base_url.rstrip("/")
+        self.bundle_type = bundle_type
+        self.bundle_size = max(1, bundle_size)
+        self.retries = retries
+        self.backoff = backoff
+        self.json_backend = json_backend
+        self.headers = {"Content-Type": "application/fhir+json", "Accept": "application/fhir+json", **(headers or {})}
+        self.pool = ConnectionPool(base_url, size=max_in_flight, timeout=timeout)
+        self.uploaded = 0
+        self.failed = 0
+        self.errors = []
+        self.accepted = set() # keys of resources the server stored
+        self._pending = [] # (resource, key)
+        self._futures = []
+        self._lock = threading.Lock()
+        # Bounds bundles held in memory: add() blocks while max_in_flight bundles are sending
+        self._in_flight = threading.BoundedSemaphore(max(1, max_in_flight))
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_in_flight))
+
+    def add(self, resource, key=None):
+        if not resource.get("resourceType") or not resource.get("id"):
+            raise ValueError("Resources need a resourceType and an id to be uploaded")
+        self._pending.append((resource, key))
+        if len(self._pending) >= self.bundle_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        self._in_flight.acquire()
+        future = self._executor.submit(self._send_bundle, pending)
+        future.add_done_callback(lambda _: self._in_flight.release())
+        self._futures = [f for f in self._futures if not f.done()]
+        self._futures.append(future)
+
+    def drain(self):
+        """Send what is pending and wait for every bundle sent so far, keeping the uploader open."""
+        self.flush()
+        futures, self._futures = self._futures, []
+        wait(futures)
+
+    def close(self):
+        """Send what is left, wait for every bundle and release connections. Returns (uploaded, failed)."""
+        self.flush()
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+        return self.uploaded, self.failed
+
+    def make_bundle(self, resources) -> dict:
+        return {
+            "resourceType": "Bundle",
+            "type": self.bundle_type,
+            "entry": [
+                {
+                    "fullUrl": f"{self.base_url}/{r['resourceType']}/{r['id']}",
+                    "resource": r,
+                    "request": {"method": "PUT", "url": f"{r['resourceType']}/{r['id']}"},
+                }
+                for r in resources
+            ],
+        }
+
+    def _send_bundle(self, pending):
+        resources = [resource for resource, _ in pending]
+        stored, error = [False] * len(resources), None
+        try:
+            body = serialization.dumps(self.make_bundle(resources), None, self.json_backend)
+            with metrics.stage("upload") as st:
+                st.bytes = len(body)
+                st.count = len(resources)
+                status, response = self._post(body)
+            stored = self._entries_ok(status, response, len(resources))
+            if not all(stored):
+                error = f"HTTP {status}, {sum(stored)}/{len(resources)} entries accepted"
+        except Exception as e:
+            error = str(e)
+        keys = [key for (_, key), ok in zip(pending, stored) if ok and key is not None]
+        ok = sum(stored)
+        self._record(ok, len(resources) - ok, error and f"Bundle of {len(resources)} failed: {error}", keys)
+
+    def _post(self, body):
+        """POST a Bundle to the base URL, retrying transport errors and 429/5xx with exponential backoff."""
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                status, headers, data = self.pool.request("POST", "", body, self.headers)
+            except (OSError, http.client.HTTPException):
+                if last:
+                    raise
+                delay = None
+            else:
+                if status not in RETRY_STATUSES or last:
+                    return status, data
+                delay = headers.get("Retry-After")
+            metrics.incr("upload.retries")
+            time.sleep(self._delay(attempt, delay))
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(MAX_BACKOFF, float(retry_after))
+            except ValueError:
+                pass # HTTP-date form; fall back to backoff
+        return min(MAX_BACKOFF, self.backoff * 2 ** attempt)
+
+    def _entries_ok(self, status, data, expected) -> list:
+        """Whether the server accepted each entry, from the transaction/batch-response Bundle."""
+        rejected = [False] * expected
+        if not 200 <= status < 300:
+            return rejected
+        try:
+            reply = serialization.loads(data, self.json_backend)
+        except ValueError:
+            return rejected
+        entries = reply.get("entry", [])
+        if len(entries) != expected:
+            return rejected
+        return [str(e.get("response", {}).get("status", "")).startswith("2") for e in entries]
+
+    def _record(self, uploaded, failed, error=None, keys=()):
+        with self._lock:
+            self.uploaded += uploaded
+            self.failed += failed
+            self.accepted.update(keys)
+            if error:
+                self.errors.append(error)
+        metrics.incr("upload.resources", uploaded)
+        if failed:
+            metrics.incr("upload.failures", failed)
+            print(f"   [Upload] {error}")
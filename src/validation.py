@@ -0,0 +1,225 @@
+"""
+In-process structural validation of generated Questionnaires.
+
+Covers the mistakes this mapper can actually make, in one pass over the item
+tree per resource, so every output can be checked as it is produced instead
+of running an external FHIR validator afterwards:
+
+    - linkIds present and unique (page-/section- label slugs can collide)
+    - item types known, with the fields each type needs or must not have
+    - enableWhen questions and linkId='...' literals point at existing items
+    - %name references in FHIRPath expressions (e.g. %q1Score from
+      calculations) resolve to variables in scope
+
+Run standalone over written outputs:  python src/validation.py output/
+"""
+import argparse
+import glob
+import gzip
+import os
+import re
+import sys
+import time
+
+import serialization
+from metrics import metrics
+
+MODES = ("off", "warn", "error")
+MAX_REPORTED = 10 # Issues printed per form in "warn" mode
+
+STATUSES = {"draft", "active", "retired", "unknown"}
+ITEM_TYPES = {"group", "display", "boolean", "decimal", "integer", "date", "dateTime", "time", "string", "text",
+              "url", "choice", "open-choice", "attachment", "reference", "quantity"}
+ANSWER_TYPES = {"choice", "open-choice"}
+OPERATORS = {"exists", "=", "!=", ">", "<", ">=", "<="}
+
+EXT = "http://hl7.org/fhir/StructureDefinition/"
+SDC = "http://hl7.org/fhir/uv/sdc/StructureDefinition/"
+VARIABLE_URL = EXT + "variable"
+EXPRESSION_URLS = {EXT + "cqf-expression", SDC + "sdc-questionnaire-calculatedExpression",
+                   SDC + "sdc-questionnaire-initialExpression", SDC + "sdc-questionnaire-enableWhenExpression",
+                   SDC + "sdc-questionnaire-answerExpression", SDC + "sdc-questionnaire-candidateExpression"}
+FHIRPATH = "text/fhirpath"
+# Environment variables every FHIRPath evaluation in a Questionnaire has
+BUILTIN_VARIABLES = {"resource", "rootResource", "context", "questionnaire", "qitem", "ucum", "sct", "loinc",
+                     "factory", "terminologies", "server", "us-zip", "vs", "ext"}
+
+VARIABLE_REF_RE = re.compile(r"%(\w+)")
+LINK_ID_REF_RE = re.compile(r"linkId\s*=\s*'([^']*)'")
+
+class ValidationError(ValueError):
+    def __init__(self, issues):
+        self.issues = issues
+        more = f" (+{len(issues) - 1} more)" if len(issues) > 1 else ""
+        super().__init__(f"{len(issues)} validation issue(s): {issues[0]}{more}")
+
+def validate_questionnaire(resource) -> list:
+    """Returns issues as 'location: message' strings; empty when the resource is valid."""
+    issues = []
+    if not isinstance(resource, dict) or resource.get("resourceType") != "Questionnaire":
+        return ["Questionnaire: resourceType must be 'Questionnaire'"]
+    if resource.get("status") not in STATUSES:
+        issues.append(f"Questionnaire: status must be one of {', '.join(sorted(STATUSES))}")
+
+    link_ids = {} # linkId -> occurrences
+    enable_when = [] # (location, question linkId)
+    link_refs = [] # (location, linkId literal in an expression)
+
+    root_vars = _scan_extensions(resource, "Questionnaire", BUILTIN_VARIABLES, issues, link_refs)
+    # (item, parent location, index): item locations are only spelled out for items without a linkId
+    stack = [(item, "", i, root_vars) for i, item in reversed(list(enumerate(resource.get("item") or ())))]
+    while stack:
+        item, parent, index, visible = stack.pop()
+        link_id = item.get("linkId")
+        if not isinstance(link_id, str) or not link_id:
+            location = f"{parent}/item[{index}]" if parent else f"item[{index}]"
+            issues.append(f"{location}: missing linkId")
+        else:
+            location = link_id
+            link_ids[link_id] = link_ids.get(link_id, 0) + 1
+
+        _check_item(item, location, issues)
+        for condition in item.get("enableWhen") or ():
+            question = condition.get("question")
+            enable_when.append((location, question))
+            if condition.get("operator") not in OPERATORS:
+                issues.append(f"{location}: enableWhen on '{question}' has an invalid operator")
+            if not any(key.startswith("answer") for key in condition):
+                issues.append(f"{location}: enableWhen on '{question}' has no answer[x]")
+
+        visible = _scan_extensions(item, location, visible, issues, link_refs)
+        children = item.get("item") or ()
+        for i in range(len(children) - 1, -1, -1):
+            stack.append((children[i], location, i, visible))
+
+    for link_id, count in link_ids.items():
+        if count > 1:
+            issues.append(f"{link_id}: linkId is used by {count} items")
+    for location, question in enable_when:
+        if question not in link_ids:
+            issues.append(f"{location}: enableWhen refers to unknown item '{question}'")
+    for location, link_id in link_refs:
+        if link_id not in link_ids:
+            issues.append(f"{location}: expression refers to unknown item '{link_id}'")
+    return issues
+
+def _check_item(item, location, issues):
+    item_type = item.get("type")
+    if item_type not in ITEM_TYPES:
+        issues.append(f"{location}: unknown item type '{item_type}'")
+        return
+    children = item.get("item")
+    if item_type == "group":
+        if not children:
+            issues.append(f"{location}: group has no nested items")
+    elif item_type == "display":
+        if children:
+            issues.append(f"{location}: display item has nested items")
+        if "required" in item or "repeats" in item:
+            issues.append(f"{location}: display item cannot be required or repeat")
+    if item_type in ("group", "display") and "initial" in item:
+        issues.append(f"{location}: {item_type} item cannot have an initial value")
+
+    options = item.get("answerOption")
+    if options is not None:
+        if item_type not in ANSWER_TYPES:
+            issues.append(f"{location}: answerOption on a '{item_type}' item")
+        if "answerValueSet" in item:
+            issues.append(f"{location}: has both answerOption and answerValueSet")
+        for n, option in enumerate(options):
+            coding = option.get("valueCoding")
+            if coding is not None:
+                if not coding.get("code"):
+                    issues.append(f"{location}: answerOption[{n}] has no code")
+            elif not any(key.startswith("value") for key in option):
+                issues.append(f"{location}: answerOption[{n}] has no value")
+    elif "answerValueSet" in item and item_type not in ANSWER_TYPES:
+        issues.append(f"{location}: answerValueSet on a '{item_type}' item")
+
+    for key in ("required", "repeats", "readOnly"):
+        if key in item and not isinstance(item[key], bool):
+            issues.append(f"{location}: {key} must be a boolean")
+
+def _scan_extensions(element, location, visible, issues, link_refs):
+    """Checks element's FHIRPath expressions; returns the variables visible to it and its children."""
+    extensions = element.get("extension")
+    if not extensions:
+        return visible
+    expressions = []
+    own = []
+    for ext in extensions:
+        url = ext.get("url")
+        if url == VARIABLE_URL:
+            value = ext.get("valueExpression") or {}
+            if not value.get("name"):
+                issues.append(f"{location}: variable without a name")
+            else:
+                own.append(value["name"])
+            expressions.append(value)
+        elif url in EXPRESSION_URLS:
+            expressions.append(ext.get("valueExpression") or {})
+    if own:
+        visible = visible.union(own)
+    for value in expressions:
+        if value.get("language") != FHIRPATH:
+            continue
+        expression = value.get("expression") or ""
+        for name in VARIABLE_REF_RE.findall(expression):
+            if name not in visible:
+                issues.append(f"{location}: expression uses undefined variable %{name}")
+        link_refs.extend((location, link_id) for link_id in LINK_ID_REF_RE.findall(expression))
+    return visible
+
+def check_output(resource, mode="warn", name=""):
+    """
+    Validation stage run after transform(). "warn" prints the issues, "error"
+    raises ValidationError so the form fails; returns the issues.
+    """
+    if mode == "off":
+        return []
+    with metrics.stage("validate") as st:
+        issues = validate_questionnaire(resource)
+        st.count = 1
+    if issues:
+        metrics.incr("validate.invalid_forms")
+        metrics.incr("validate.issues", len(issues))
+        if mode == "error":
+            raise ValidationError(issues)
+        for issue in issues[:MAX_REPORTED]:
+            print(f"   [Validate] {name}: {issue}")
+        if len(issues) > MAX_REPORTED:
+            print(f"   [Validate] {name}: ... {len(issues) - MAX_REPORTED} more")
+    return issues
+
+def validate_files(paths, backend="auto"):
+    """Yield (path, issues) for written Questionnaire files (.json or .json.gz)."""
+    for path in paths:
+        try:
+            with (gzip.open if path.endswith(".gz") else open)(path, "rb") as f:
+                resource = serialization.loads(f.read(), backend)
+        except (OSError, ValueError) as e:
+            yield path, [f"unreadable: {e}"]
+            continue
+        yield path, validate_questionnaire(resource)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate generated FHIR Questionnaires.")
+    parser.add_argument("paths", nargs="+", help="fhir_*.json(.gz) files or directories containing them")
+    parser.add_argument("--json-backend", default="auto")
+    args = parser.parse_args()
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "fhir_*.json")) + glob.glob(os.path.join(path, "fhir_*.json.gz"))))
+        else:
+            files.append(path)
+
+    start = time.perf_counter()
+    invalid = 0
+    for path, issues in validate_files(files, args.json_backend):
+        if issues:
+            invalid += 1
+            for issue in issues:
+                print(f"{path}: {issue}")
+    print(f"Validated {len(files)} Questionnaires in {time.perf_counter() - start:.2f}s ({invalid} with issues)")
+    sys.exit(1 if invalid else 0)
@@ -0,0 +1,149 @@
+"""
+Daemon mode: watch Config.input_dir and convert forms as they are saved.
+The mapper, DB connection/pool and concept cache, translation memory and the
+in-process translations stay warm between conversions.
+"""
+import fnmatch
+import os
+import threading
+import time
+
+from convert import load_form, convert_serial, output_name
+from incremental import Manifest, config_fingerprint, file_fingerprint
+from metrics import metrics
+
+class PollingWatcher:
+    """
+    Polls a directory for files matching pattern. poll() returns files that are
+    new or changed and have then stayed unchanged (same mtime and size) for
+    'debounce' seconds, so a burst of saves yields one conversion.
+    """
+
+    def __init__(self, directory, pattern="*.json", debounce=2.0, clock=time.monotonic):
+        self.directory = directory
+        self.pattern = pattern
+        self.debounce = debounce
+        self._clock = clock
+        self.reported = {} # path -> stat signature last handed out
+        self.pending = {} # path -> (signature, time it was first seen)
+
+    def scan(self) -> dict:
+        found = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or not fnmatch.fnmatch(entry.name, self.pattern):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError: # Deleted mid-scan
+                    continue
+                found[entry.path] = (st.st_mtime_ns, st.st_size)
+        return found
+
+    def poll(self) -> list:
+        now = self._clock()
+        current = self.scan()
+        settled = []
+        for path, signature in current.items():
+            if self.reported.get(path) == signature:
+                self.pending.pop(path, None)
+                continue
+            seen = self.pending.get(path)
+            if seen is None or seen[0] != signature:
+                self.pending[path] = (signature, now)
+            elif now - seen[1] >= self.debounce:
+                del self.pending[path]
+                self.reported[path] = signature
+                settled.append(path)
+        for path in set(self.reported).difference(current):
+            del self.reported[path]
+        for path in set(self.pending).difference(current):
+            del self.pending[path]
+        return sorted(settled)
+
+    def retry(self, path, delay):
+        """Hand path out again after about delay seconds, even if it does not change."""
+        signature = self.reported.pop(path, None)
+        if signature is not None:
+            self.pending[path] = (signature, self._clock() + delay - self.debounce)
+
+    def retry_all(self):
+        """Hand every file out again on the next poll."""
+        for path in list(self.reported):
+            self.retry(path, 0)
+
+    def batches(self, interval=1.0, stop=None, before_poll=None):
+        """Yield lists of settled files until stop (a threading.Event) is set. before_poll runs before each poll."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            if before_poll:
+                before_poll()
+            batch = self.poll()
+            if batch:
+                yield batch
+            stop.wait(interval)
+
+def run_daemon(cfg, mapper, uploader=None, profile_dir=None, stop=None):
+    """Convert changed forms until interrupted (Ctrl+C) or stop is set."""
+    manifest = Manifest(cfg.output_dir)
+    config_digest = config_fingerprint(cfg)
+    # Files already in place are picked up after one debounce period; the manifest skips unchanged ones
+    watcher = PollingWatcher(cfg.input_dir, debounce=cfg.watch_debounce)
+
+    def check_components():
+        # An edited component changes the config fingerprint, so every form is converted again
+        nonlocal config_digest
+        if mapper.refresh_components():
+            config_digest = config_fingerprint(cfg)
+            print("   [Watch] Components changed, converting forms again")
+            watcher.retry_all()
+
+    print(f"Watching {cfg.input_dir} every {cfg.watch_interval}s (Ctrl+C to stop)...")
+    try:
+        for batch in watcher.batches(cfg.watch_interval, stop, check_components):
+            for file_path in convert_batch(cfg, mapper, manifest, config_digest, batch, uploader, profile_dir):
+                watcher.retry(file_path, cfg.watch_retry_interval)
+    except KeyboardInterrupt:
+        print("Stopping watcher.")
+
+def convert_batch(cfg, mapper, manifest, config_digest, files, uploader=None, profile_dir=None):
+    """
+    Convert the changed forms among files. Returns the forms written with
+    strings left untranslated (e.g. during a backend outage) or that failed to
+    upload: they are not recorded in the manifest, so they are converted again.
+    """
+    start = time.perf_counter()
+    incomplete = []
+    forms = []
+    fingerprints = {}
+    for file_path in files:
+        try:
+            fingerprint = file_fingerprint(file_path, config_digest)
+            if manifest.is_fresh(os.path.basename(file_path), fingerprint,
+                                 os.path.join(cfg.output_dir, output_name(file_path, cfg.output_gzip))):
+                continue
+            forms.append((file_path, load_form(file_path, cfg.json_backend)))
+            fingerprints[file_path] = fingerprint
+        except (OSError, ValueError) as e:
+            # Deleted or half-written; it is picked up again on its next change
+            print(f"Failed {file_path}: {e}")
+    if not forms:
+        return incomplete
+
+    # Translations accumulate in the mapper, so later saves only translate new strings
+    mapper.prepare_translations([data for _, data in forms])
+    sink = uploader.add if uploader else None
+    converted = []
+    for file_path, out_name, error, untranslated in convert_serial(cfg, mapper, forms, profile_dir, sink):
+        if error:
+            print(f"Failed {file_path}: {error}")
+        elif untranslated:
+            print(f"Mapped: {out_name} ({untranslated} strings untranslated, will retry)")
+            incomplete.append(file_path)
+        else:
+            print(f"Mapped: {out_name}")
+            converted.append(file_path)
+    incomplete.extend(manifest.save_converted(converted, fingerprints, uploader))
+    metrics.incr("watch.batches")
+    print(f"Converted {len(forms)} forms in {time.perf_counter() - start:.2f}s")
+    return incomplete
@@ -0,0 +1,66 @@
+"""
+Process-pool conversion. Each worker process owns its own AmpathMapper and a
+DB handle of the parent's backend; translations are done once in the parent
+and shipped to the workers so they never call the translation backend themselves.
+"""
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor
+
+from database import create_database
+from services.static import StaticTranslationService
+from mappers.ampath import AmpathMapper
+from convert import load_form, convert_form
+from metrics import metrics
+
+# Per-process state, created by init_worker()
+_mapper = None
+_profile_dir = None
+_init_error = None
+
+def init_worker(config, translations, profile_dir=None, db_backend=None):
+    """
+    A failure here is kept and reported for every form the worker gets:
+    an exception from a pool initializer breaks the whole pool.
+    """
+    global _mapper, _profile_dir, _init_error
+    _profile_dir = profile_dir
+    try:
+        db_service = create_database(config, db_backend)
+        db_service.connect()
+    except Exception as e:
+        _init_error = f"Worker could not open the {db_backend or 'configured'} database: {e}"
+        return
+    # Runs when the worker process shuts down
+    Finalize(db_service, db_service.close, exitpriority=10)
+    _mapper = AmpathMapper(config, db_service, StaticTranslationService(translations))
+    # The parent already translated (and concept-seeded) the corpus
+    _mapper.shared_translations = translations
+    _mapper.prepared_strings.update(translations)
+
+def convert_file(file_path):
+    """
+    Load, transform and write one form.
+    Returns ((file_path, out_name, error, untranslated), metrics recorded for this file).
+    """
+    metrics.reset()
+    if _init_error:
+        return (file_path, None, _init_error, 0), metrics.snapshot()
+    try:
+        data = load_form(file_path, _mapper.config.json_backend)
+    except Exception as e:
+        result = (file_path, None, str(e), 0)
+    else:
+        result = convert_form(_mapper, file_path, data, _mapper.config.output_dir, _profile_dir)
+    return result, metrics.snapshot()
+
+def convert_parallel(config, translations, files, workers, profile_dir=None, db_backend=None):
+    """
+    Convert files across a process pool. Results are yielded in input order.
+    db_backend names the backend workers open (database.BACKENDS), e.g. the parent's.
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(config, translations, profile_dir, db_backend)) as pool:
+        chunksize = max(1, len(files) // (workers * 4))
+        for result, worker_metrics in pool.map(convert_file, files, chunksize=chunksize):
+            metrics.merge(worker_metrics)
+            yield result